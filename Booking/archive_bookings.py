@@ -0,0 +1,26 @@
+import sys
+
+from booking import db, archiveCompletedBookings
+
+# Moves completed bookings (productProgress at 100 and past projEndDate) and their
+# bookingproducts rows into the archive tables, except the newest booking, which stays in
+# the hot table to anchor AUTO_INCREMENT. Safe to run repeatedly, e.g. from cron.
+# The Booking service may serve archived bookings from its read cache for up to
+# BOOKING_CACHE_TTL seconds after a run.
+# Usage: python archive_bookings.py [batch_size]
+
+def archive():
+    batchSize = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print("Creating archive tables if needed...")
+    db.create_all()
+    print("Archiving completed bookings...")
+    try:
+        archived = archiveCompletedBookings(batchSize)
+    except Exception as e:
+        print(f"Error archiving bookings: {str(e)}")
+        return False
+    print(f"Archived {archived} bookings.")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if archive() else 1)
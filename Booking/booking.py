@@ -1,7 +1,12 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS, cross_origin
 from flask_sqlalchemy import SQLAlchemy
+from collections import OrderedDict
+from datetime import date
 import json
+import os
+import threading
+import time
 
 
 # ==================================== CONNECTION SPECIFICATION ====================================== #
@@ -21,8 +26,9 @@ CORS(app)
 class Booking(db.Model):
     __tablename__ = 'booking'
 
-    bookingID = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(50), nullable=False)
+    bookingID = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # InnoDB secondary indexes carry the primary key, so this also serves ORDER BY bookingID
+    username = db.Column(db.String(50), nullable=False, index=True)
     comments = db.Column(db.Text, nullable=True)
     productProgress = db.Column(db.Float(precision=2), nullable=True)
     projStartDate = db.Column(db.Date, nullable=True)
@@ -76,17 +82,189 @@ class BookingProduct(db.Model):
         }
         return bookingProduct
 
+############ Archive Class Object Creation ############
+# Completed bookings (productProgress at 100 and past projEndDate) are moved here by
+# archive_bookings.py so the hot tables and their indexes only hold live projects
+
+
+class BookingArchive(db.Model):
+    __tablename__ = 'booking_archive'
+
+    bookingID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    username = db.Column(db.String(50), nullable=False, index=True)
+    comments = db.Column(db.Text, nullable=True)
+    productProgress = db.Column(db.Float(precision=2), nullable=True)
+    projStartDate = db.Column(db.Date, nullable=True)
+    projEndDate = db.Column(db.Date, nullable=True)
+
+    json = Booking.json
+
+
+class BookingProductArchive(db.Model):
+    __tablename__ = 'bookingproducts_archive'
+
+    bookingID = db.Column(db.Integer, db.ForeignKey(
+        'booking_archive.bookingID'), primary_key=True)
+    productID = db.Column(db.Integer, primary_key=True)
+
+    json = BookingProduct.json
+
+
+def archiveCompletedBookings(batchSize=500):
+    # Copies each batch into the archive tables and deletes it from the hot tables in the
+    # same transaction, so a booking is always visible in exactly one place.
+    # The newest booking row is never archived, even when it is complete: before MySQL 8.0
+    # InnoDB resets AUTO_INCREMENT to MAX(bookingID)+1 of the hot table on restart, and
+    # keeping the newest row there keeps that above every archived bookingID.
+    bookingColumns = ["bookingID", "username", "comments", "productProgress", "projStartDate", "projEndDate"]
+    productColumns = ["bookingID", "productID"]
+    archived = 0
+    while True:
+        newest = db.session.query(db.func.max(Booking.bookingID)).scalar()
+        if newest is None:
+            return archived
+        ids = [row.bookingID for row in Booking.query.with_entities(Booking.bookingID)
+               .filter(Booking.productProgress >= 100, Booking.projEndDate < date.today(),
+                       Booking.bookingID < newest)
+               .order_by(Booking.bookingID).limit(batchSize)]
+        if not ids:
+            return archived
+        try:
+            db.session.execute(BookingArchive.__table__.insert().from_select(bookingColumns,
+                Booking.query.with_entities(*[getattr(Booking, c) for c in bookingColumns])
+                .filter(Booking.bookingID.in_(ids)).statement))
+            db.session.execute(BookingProductArchive.__table__.insert().from_select(productColumns,
+                BookingProduct.query.with_entities(*[getattr(BookingProduct, c) for c in productColumns])
+                .filter(BookingProduct.bookingID.in_(ids)).statement))
+            BookingProduct.query.filter(BookingProduct.bookingID.in_(ids)).delete(synchronize_session=False)
+            Booking.query.filter(Booking.bookingID.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        archived += len(ids)
+
+
+# ======================================= BOOKING READ CACHE ========================================== #
+
+############ Bounded LRU cache with TTL for serialized bookings ############
+class BookingCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+# archive_bookings.py runs as a separate process and cannot clear this cache, so after an
+# archive run default /getinformation and /productprogress reads can keep returning an
+# archived booking for up to BOOKING_CACHE_TTL seconds
+bookingCache = BookingCache(int(os.getenv("BOOKING_CACHE_SIZE", "1024")), float(os.getenv("BOOKING_CACHE_TTL", "30")))
+
+def invalidateUserBookings(username):
+    bookingCache.delete(("user", username, False), ("user", username, True))
+
+@app.route("/bookingCacheStats", methods=["GET"])
+def getBookingCacheStats():
+    return jsonify(bookingCache.stats())
 
 # =============================== SCENARIO 2: CUSTOMER MAKES BOOKING ================================== #
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def userBookingsQuery(username, after=None, active=False, model=Booking):
+    query = model.query.filter_by(username=username)
+    if after is not None:
+        query = query.filter(model.bookingID > after)
+    if active:
+        query = query.filter(db.or_(model.productProgress == None, model.productProgress < 100))
+    return query.order_by(model.bookingID)
+
+def userBookings(username, after=None, active=False, limit=None, archived=False):
+    # Archived bookings are all complete, so the archive is only read when asked for and
+    # never for active-only listings
+    models = [Booking, BookingArchive] if archived and not active else [Booking]
+    bookings = []
+    for model in models:
+        query = userBookingsQuery(username, after, active, model)
+        if limit is not None:
+            query = query.limit(limit)
+        bookings.extend(query.all())
+    bookings.sort(key=lambda booking: booking.bookingID)
+    return bookings if limit is None else bookings[:limit]
+
+def wantsArchived():
+    return request.args.get("archived", "false").lower() == "true"
+
 @app.route("/productprogress/<string:username>", methods=['GET'])
 @cross_origin(supports_credentials=True)
 def UserProductProgress(username):
-    # print(username)
-    bookingsProgress = Booking.query.filter_by(username=username).all()
-    if bookingsProgress:
-        return jsonify({"UserBookings":[booking.json() for booking in Booking.query.filter_by(username=username).all() ]}), 200
-    else: 
+    active = request.args.get("active", "false").lower() == "true"
+    archived = wantsArchived()
+    if "limit" not in request.args and "after" not in request.args:
+        key = ("user", username, active)
+        bookings = None if archived else bookingCache.get(key)
+        if bookings is None:
+            bookings = [booking.json() for booking in userBookings(username, active=active, archived=archived)]
+            if not archived:
+                bookingCache.set(key, bookings)
+        if bookings:
+            return jsonify({"UserBookings": bookings}), 200
+        return jsonify(False), 404
+
+    try:
+        limit = min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        after = request.args.get("after", type=int)
+        if limit < 1 or ("after" in request.args and after is None):
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer and after a bookingID"}), 400
+    # Fetch one extra row to tell whether another page follows
+    bookings = userBookings(username, after, active, limit + 1, archived)
+    if not bookings and after is None:
         return jsonify(False), 404
+    nextAfter = bookings[limit - 1].bookingID if len(bookings) > limit else None
+    return jsonify({"UserBookings": [booking.json() for booking in bookings[:limit]], "next": nextAfter}), 200
 
 
 
@@ -94,25 +272,28 @@ def UserProductProgress(username):
 @app.route("/newbooking", methods=["POST"])
 @cross_origin(supports_credentials=True)
 def addBooking():
-    lastBooking = Booking.query.order_by(Booking.bookingID.desc()).first()
-    if (lastBooking == None ) : 
-        newBID = 1
-    else: 
-        newBID = lastBooking.bookingID + 1
-
     data = request.get_json()
-    data = json.loads(data)
-    booking = Booking(newBID, data["username"], data["comments"], data["productProgress"], data["projStartDate"], data["projEndDate"])
-    products = data['products']
-    db.session.add(booking)
-    db.session.commit()
-    for p in products:
-        pdt = BookingProduct(newBID, p)
-        db.session.add(pdt)
-    db.session.commit()
-    if (Booking.query.get(newBID)):
-        return jsonify({"status": "Successful Creation", "bookingID" : newBID} ), 201
-    return jsonify({"status": "Failed Creation"} ), 400
+    if isinstance(data, str):
+        data = json.loads(data)
+    # bookingproducts is keyed on (bookingID, productID), so each product is stored once
+    products = list(dict.fromkeys(data['products']))
+    try:
+        # bookingID is assigned by the AUTO_INCREMENT column on flush, so concurrent
+        # orders can never collide, and the booking and its products share one commit
+        booking = Booking(None, data["username"], data["comments"], data["productProgress"], data["projStartDate"], data["projEndDate"])
+        db.session.add(booking)
+        db.session.flush()
+        # Read before commit: the commit expires the instance, and touching it afterwards
+        # would SELECT the row again
+        bookingID, username = booking.bookingID, booking.username
+        db.session.bulk_insert_mappings(BookingProduct, [{"bookingID": bookingID, "productID": p} for p in products])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error("Failed to create booking: %s", e)
+        return jsonify({"status": "Failed Creation"} ), 400
+    invalidateUserBookings(username)
+    return jsonify({"status": "Successful Creation", "bookingID" : bookingID} ), 201
 
 @app.route("/productprogress/<string:bookingID>", methods=['PUT'])
 @cross_origin(supports_credentials=True)
@@ -121,29 +302,113 @@ def updateProductProgress(bookingID):
     comments = request.json.get('comments')
     uProductProgress = float(uProductProgress)
     order = Booking.query.get(bookingID)
+    if order is None:
+        # Unknown, or archived and therefore no longer updatable
+        return jsonify(False), 404
     order.set_productProgress(uProductProgress)
     order.set_comments(comments)
     db.session.add(order)
     db.session.commit()
+    invalidateUserBookings(order.username)
     order = order.json()
+    bookingCache.set(("booking", order["bookingID"]), order)
     return jsonify(order), 200
 
+@app.route("/cancelbooking/<int:bookingID>", methods=['DELETE'])
+@cross_origin(supports_credentials=True)
+def cancelBooking(bookingID):
+    # Compensating action for placeOrders when a later step of an order fails
+    order = Booking.query.get(bookingID)
+    if order is None:
+        return jsonify({"status": "Not Found"}), 404
+    try:
+        BookingProduct.query.filter_by(bookingID=bookingID).delete(synchronize_session=False)
+        db.session.delete(order)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error("Failed to cancel booking %s: %s", bookingID, e)
+        return jsonify({"status": "Failed Cancellation"}), 500
+    bookingCache.delete(("booking", bookingID))
+    invalidateUserBookings(order.username)
+    return jsonify({"status": "Cancelled", "bookingID": bookingID}), 200
+
 @app.route("/getinformation/<string:bookingID>", methods=['GET'])
 @cross_origin(supports_credentials=True)
 def getInformation(bookingID):
-    order = Booking.query.get(bookingID)
-    order = order.json()
+    try:
+        key = ("booking", int(bookingID))
+    except ValueError:
+        return jsonify(False), 404
+    order = bookingCache.get(key)
+    if order is None:
+        order = Booking.query.get(key[1])
+        if order is None and wantsArchived():
+            # Archived rows are not cached: the key is shared with default reads, which
+            # must not see archived bookings
+            archived = BookingArchive.query.get(key[1])
+            if archived is None:
+                return jsonify(False), 404
+            return jsonify(archived.json())
+        if order is None:
+            return jsonify(False), 404
+        order = order.json()
+        bookingCache.set(key, order)
     return jsonify(order)
 
 @app.route("/getProducts/<string:bookingID>", methods=["GET"])
 @cross_origin(supports_credentials=True)
 def getProducts(bookingID):
     products = []
-    pdts = BookingProduct.query.filter_by(bookingID=bookingID)
+    pdts = BookingProduct.query.filter_by(bookingID=bookingID).all()
+    if not pdts and wantsArchived():
+        pdts = BookingProductArchive.query.filter_by(bookingID=bookingID).all()
     for pdt in pdts:
         products.append(pdt.productID)
     return jsonify({"products": products})
 
+@app.route("/bookingsWithProducts", methods=["GET"])
+@cross_origin(supports_credentials=True)
+def getBookingsWithProducts():
+    # Replaces a /getinformation + /getProducts pair per booking with two queries in total:
+    # one for the bookings and one IN query for all of their products
+    ids = request.args.get("ids")
+    username = request.args.get("username")
+    archived = wantsArchived()
+    if ids:
+        try:
+            bookingIDs = [int(bid) for bid in ids.split(",")]
+        except ValueError:
+            return jsonify({"error": "ids must be a comma separated list of bookingIDs"}), 400
+        if len(bookingIDs) > MAX_PAGE_SIZE:
+            return jsonify({"error": "at most {} bookingIDs per request".format(MAX_PAGE_SIZE)}), 400
+        bookings = Booking.query.filter(Booking.bookingID.in_(bookingIDs)).order_by(Booking.bookingID).all()
+        if archived and len(bookings) < len(set(bookingIDs)):
+            found = {booking.bookingID for booking in bookings}
+            bookings += BookingArchive.query.filter(BookingArchive.bookingID.in_([bid for bid in bookingIDs if bid not in found])).all()
+            bookings.sort(key=lambda booking: booking.bookingID)
+    elif username:
+        bookings = userBookings(username, archived=archived)
+    else:
+        return jsonify({"error": "ids or username is required"}), 400
+
+    products = {booking.bookingID: [] for booking in bookings}
+    if products:
+        productModels = [BookingProduct, BookingProductArchive] if archived else [BookingProduct]
+        for model in productModels:
+            for pdt in model.query.filter(model.bookingID.in_(products.keys())):
+                products[pdt.bookingID].append(pdt.productID)
+
+    result = []
+    for booking in bookings:
+        entry = booking.json()
+        entry["products"] = products[booking.bookingID]
+        result.append(entry)
+    response = {"bookings": result}
+    if ids:
+        response["missing"] = [bid for bid in bookingIDs if bid not in products]
+    return jsonify(response)
+
 
 if __name__=='__main__':
     app.run(host='0.0.0.0',port=5250, debug=True)
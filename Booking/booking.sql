@@ -10,7 +10,8 @@ CREATE TABLE booking (
     productProgress DOUBLE,
     projStartDate DATE,
     projEndDate DATE,
-    PRIMARY KEY (bookingID)
+    PRIMARY KEY (bookingID),
+    INDEX ix_booking_username (username)
 ) ENGINE=InnoDB; 
 
 #date is in YYYY-MM-DD
@@ -33,3 +34,24 @@ INSERT INTO bookingproducts (bookingID, productID) VALUES (1,2);
 INSERT INTO bookingproducts (bookingID, productID) VALUES (1,3);
 INSERT INTO bookingproducts (bookingID, productID) VALUES (1,4);
 INSERT INTO bookingproducts (bookingID, productID) VALUES (1,5);
+
+# Filled by archive_bookings.py. The newest booking row always stays in the booking table,
+# so the AUTO_INCREMENT value InnoDB recomputes from it on restart (before MySQL 8.0)
+# never hands out a bookingID that is already archived.
+CREATE TABLE booking_archive (
+    bookingID INT NOT NULL,
+    username VARCHAR(50) NOT NULL,
+    comments TEXT ,
+    productProgress DOUBLE,
+    projStartDate DATE,
+    projEndDate DATE,
+    PRIMARY KEY (bookingID),
+    INDEX ix_booking_archive_username (username)
+) ENGINE=InnoDB; 
+
+CREATE TABLE bookingproducts_archive (
+    bookingID INT,
+    productID INT,
+    PRIMARY KEY (bookingID, productID),
+    CONSTRAINT fk_bookingproducts_archive FOREIGN KEY (bookingID) REFERENCES booking_archive (bookingID)
+) ENGINE=InnoDB; 
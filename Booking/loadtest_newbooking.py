@@ -0,0 +1,41 @@
+import json
+import sys
+import requests
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Fires concurrent /newbooking calls and checks that every booking got its own ID.
+# Usage: python loadtest_newbooking.py [base_url] [total_requests] [concurrency]
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:5250"
+TOTAL = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+def createBooking(i):
+    order = {
+        "username": "loadtest",
+        "comments": "load test booking " + str(i),
+        "productProgress": 0,
+        "projStartDate": "2020-01-01",
+        "projEndDate": "2020-12-31",
+        "products": [1, 2, 3]
+    }
+    # placeOrders sends the order as a JSON-encoded string, so do the same here
+    r = requests.post(BASE_URL + "/newbooking", json=json.dumps(order), timeout=30)
+    if r.status_code == 201:
+        return r.json()["bookingID"]
+    return None
+
+def main():
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        ids = list(pool.map(createBooking, range(TOTAL)))
+
+    created = [bid for bid in ids if bid is not None]
+    collisions = {bid: n for bid, n in Counter(created).items() if n > 1}
+    print("Requests sent:", TOTAL)
+    print("Bookings created:", len(created))
+    print("Failed requests:", TOTAL - len(created))
+    print("Duplicate booking IDs:", collisions if collisions else "none")
+    return not collisions and len(created) == TOTAL
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,38 @@
+import sys
+
+from sqlalchemy import text
+from booking import db
+
+INDEX_NAME = "ix_booking_username"
+
+def has_index(conn):
+    return conn.execute(text(
+        "SELECT COUNT(*) FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'booking' AND INDEX_NAME = :name"
+    ), {"name": INDEX_NAME}).scalar() > 0
+
+def explain(conn, label):
+    result = conn.execute(text(
+        "EXPLAIN SELECT * FROM booking WHERE username = :username ORDER BY bookingID LIMIT 20"
+    ), {"username": "clement"})
+    plan = dict(zip(result.keys(), result.fetchone()))
+    print(f"[{label}] plan: type={plan['type']} key={plan['key']} rows={plan['rows']} extra={plan['Extra']}")
+
+def migrate():
+    print("Checking booking table for a username index...")
+    with db.engine.begin() as conn:
+        explain(conn, "before")
+        if has_index(conn):
+            print(f"Index {INDEX_NAME} already exists, nothing to do.")
+            return True
+        print(f"Creating index {INDEX_NAME} on booking (username)...")
+        conn.execute(text(f"CREATE INDEX {INDEX_NAME} ON booking (username)"))
+        if not has_index(conn):
+            print("Index creation could not be verified.")
+            return False
+        print("Index created successfully!")
+        explain(conn, "after")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if migrate() else 1)
@@ -2,9 +2,9 @@ import os
 import json
 import re
 import bcrypt
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from sqlalchemy.exc import SQLAlchemyError
@@ -133,9 +133,62 @@ def addUser(username):
         app.logger.error(f"Error creating user: {str(e)}")
         return jsonify({"error": "An error occurred while creating the account"}), 500
 
+# Keyset pagination settings for the bulk listing
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def customer_page(after: Optional[str], limit: int) -> List[Customer]:
+    """Return up to `limit` customers ordered by username, starting after `after`."""
+    query = Customer.query.order_by(Customer.username)
+    if after is not None:
+        query = query.filter(Customer.username > after)
+    return query.limit(limit).all()
+
+def stream_customers(fmt: str) -> Response:
+    """Stream every customer as NDJSON or a chunked JSON document, one page at a time."""
+    def generate() -> Iterator[str]:
+        if fmt == 'json':
+            yield '{"users": ['
+        after = None
+        first = True
+        while True:
+            page = customer_page(after, MAX_PAGE_SIZE)
+            for customer in page:
+                if fmt == 'json':
+                    yield ('' if first else ', ') + json.dumps(customer.json())
+                else:
+                    yield json.dumps(customer.json()) + '\n'
+                first = False
+            if len(page) < MAX_PAGE_SIZE:
+                break
+            after = page[-1].username
+        if fmt == 'json':
+            yield ']}'
+
+    mimetype = 'application/json' if fmt == 'json' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
 @app.route("/User", methods=['GET'])
 def get_all():
-    return jsonify({"users": [customer.json() for customer in Customer.query.all()]})
+    stream = request.args.get('stream')
+    if stream is not None:
+        if stream not in ('ndjson', 'json'):
+            return jsonify({"error": "stream must be 'ndjson' or 'json'"}), 400
+        return stream_customers(stream)
+    if 'limit' not in request.args and 'after' not in request.args:
+        return jsonify({"users": [customer.json() for customer in Customer.query.all()]})
+
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+
+    # Fetch one extra row to tell whether another page follows
+    page = customer_page(request.args.get('after'), limit + 1)
+    next_after = page[limit - 1].username if len(page) > limit else None
+    return jsonify({"users": [customer.json() for customer in page[:limit]], "next": next_after})
 
 @app.route("/AUser/<string:username>", methods=["POST"])
 def find_by_username(username):
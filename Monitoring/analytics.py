@@ -0,0 +1,149 @@
+import math
+import os
+import threading
+from collections import deque
+
+# Streaming analytics over the booking events Monitoring receives, in fixed memory no
+# matter how many events arrive:
+#   - SlidingTopK estimates the most ordered products over a sliding window with the
+#     Space-Saving algorithm, one summary of TOPK_CAPACITY counters per window slice.
+#   - RateAnomalyDetector tracks the number of orders per interval with an exponentially
+#     weighted mean and variance and flags intervals that stray too far from them.
+
+TOPK_WINDOW = int(os.getenv('MONITORING_TOPK_WINDOW', '900'))
+TOPK_SLICES = int(os.getenv('MONITORING_TOPK_SLICES', '15'))
+TOPK_CAPACITY = int(os.getenv('MONITORING_TOPK_CAPACITY', '100'))
+ANOMALY_INTERVAL = int(os.getenv('MONITORING_ANOMALY_INTERVAL', '10'))
+ANOMALY_ALPHA = float(os.getenv('MONITORING_ANOMALY_ALPHA', '0.1'))
+ANOMALY_THRESHOLD = float(os.getenv('MONITORING_ANOMALY_THRESHOLD', '3'))
+ANOMALY_WARMUP = int(os.getenv('MONITORING_ANOMALY_WARMUP', '30'))
+MAX_ANOMALIES = 50
+
+
+class SpaceSaving:
+    # Keeps at most capacity counters. A new item takes over the smallest counter and
+    # inherits its count as the error bound, so a count never underestimates and
+    # overestimates by at most its error.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+
+    def add(self, item, count=1):
+        if item in self.counters:
+            self.counters[item][0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            smallest = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(smallest)[0]
+            self.counters[item] = [floor + count, floor]
+
+
+class SlidingTopK:
+    def __init__(self, windowSeconds=TOPK_WINDOW, slices=TOPK_SLICES, capacity=TOPK_CAPACITY):
+        self.sliceSeconds = max(windowSeconds // slices, 1)
+        self.windowSeconds = self.sliceSeconds * slices
+        self.slices = [None] * slices
+        self.capacity = capacity
+        self.lock = threading.Lock()
+
+    def add(self, item, now, count=1):
+        number = int(now // self.sliceSeconds)
+        index = number % len(self.slices)
+        with self.lock:
+            current = self.slices[index]
+            if current is None or current[0] != number:
+                current = self.slices[index] = (number, SpaceSaving(self.capacity))
+            current[1].add(item, count)
+
+    def top(self, k, now):
+        # Merges the live slices; an item's error is the sum of its per-slice errors
+        oldest = int(now // self.sliceSeconds) - len(self.slices)
+        merged = {}
+        with self.lock:
+            for current in self.slices:
+                if current is None or current[0] <= oldest:
+                    continue
+                for item, (count, error) in current[1].counters.items():
+                    total = merged.setdefault(item, [0, 0])
+                    total[0] += count
+                    total[1] += error
+        ranked = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)[:k]
+        return [{"product": item, "count": count, "error": error, "guaranteed": count - error}
+                for item, (count, error) in ranked]
+
+
+class RateAnomalyDetector:
+    def __init__(self, interval=ANOMALY_INTERVAL, alpha=ANOMALY_ALPHA, threshold=ANOMALY_THRESHOLD, warmup=ANOMALY_WARMUP):
+        self.interval = interval
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.lock = threading.Lock()
+        self.current = None
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.seen = 0
+        self.lastZ = 0.0
+        self.anomalyCount = 0
+        self.anomalies = deque(maxlen=MAX_ANOMALIES)
+
+    def record(self, now, count=1):
+        with self.lock:
+            self.advance(now)
+            self.count += count
+
+    def advance(self, now):
+        number = int(now // self.interval)
+        if self.current is None:
+            self.current = number
+            return
+        if number - self.current > self.warmup + 1:
+            # Idle for longer than a warmup: replaying every empty interval would only
+            # teach the model zero, so skip to the last few
+            self.close(self.current)
+            self.current = number - self.warmup - 1
+        while self.current < number:
+            self.close(self.current)
+            self.current += 1
+
+    def close(self, number):
+        observed = self.count
+        self.count = 0
+        if self.seen >= self.warmup:
+            stddev = math.sqrt(self.variance)
+            # A floor of 1 order keeps near-silent periods from flagging single orders
+            z = (observed - self.mean) / max(stddev, 1.0)
+            self.lastZ = z
+            if abs(z) >= self.threshold:
+                self.anomalyCount += 1
+                self.anomalies.append({
+                    "start": number * self.interval,
+                    "end": (number + 1) * self.interval,
+                    "orders": observed,
+                    "expected": round(self.mean, 3),
+                    "stddev": round(stddev, 3),
+                    "z": round(z, 3),
+                    "kind": "spike" if z > 0 else "drop"
+                })
+        # Exponentially weighted mean and variance
+        delta = observed - self.mean
+        self.mean += self.alpha * delta
+        self.variance = (1 - self.alpha) * (self.variance + self.alpha * delta * delta)
+        self.seen += 1
+
+    def state(self, now):
+        with self.lock:
+            self.advance(now)
+            return {
+                "interval_seconds": self.interval,
+                "current_interval_orders": self.count,
+                "expected_orders": self.mean,
+                "stddev": math.sqrt(self.variance),
+                "last_z": self.lastZ,
+                "threshold": self.threshold,
+                "warming_up": self.seen < self.warmup,
+                "anomalies_total": self.anomalyCount,
+                "recent_anomalies": list(self.anomalies)
+            }
@@ -0,0 +1,233 @@
+import bisect
+import glob
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Append-only store for every event Monitoring receives. Events are appended to segment
+# files in arrival order; a segment is sealed and a new one started once it reaches
+# SEGMENT_BYTES or covers SEGMENT_SECONDS. Each segment has a sparse index of
+# (timestamp, offset) entries, one per INDEX_INTERVAL bytes, so a time-range query
+# bisects the index and scans a memory-mapped segment from close to the start of the
+# range. Segments that ended more than RETENTION_SECONDS ago are deleted by compact().
+#
+# Segment files are named after their first timestamp in milliseconds. A record is an
+# 8-byte timestamp (ms), a 4-byte length and the raw message body; an index entry is an
+# 8-byte timestamp and an 8-byte offset. Index files can always be rebuilt from the
+# segment, and are for the active segment on every start.
+
+EVENTSTORE_DIR = os.getenv('EVENTSTORE_DIR', 'events')
+SEGMENT_BYTES = int(os.getenv('EVENTSTORE_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+SEGMENT_SECONDS = int(os.getenv('EVENTSTORE_SEGMENT_SECONDS', '3600'))
+INDEX_INTERVAL = int(os.getenv('EVENTSTORE_INDEX_INTERVAL', '4096'))
+RETENTION_SECONDS = int(os.getenv('EVENTSTORE_RETENTION', str(7 * 24 * 3600)))
+COMPACT_INTERVAL = int(os.getenv('EVENTSTORE_COMPACT_INTERVAL', '300'))
+FSYNC = os.getenv('EVENTSTORE_FSYNC', 'false').lower() == 'true'
+
+RECORD_HEADER = struct.Struct('>QI')
+INDEX_ENTRY = struct.Struct('>QQ')
+
+
+class Segment:
+    def __init__(self, directory, baseTs):
+        self.baseTs = baseTs
+        self.path = os.path.join(directory, '%016d.log' % baseTs)
+        self.indexPath = os.path.join(directory, '%016d.idx' % baseTs)
+        self.indexTimes = []
+        self.indexOffsets = []
+        self.lastIndexed = None
+        self.size = 0
+        self.lastTs = baseTs
+
+    def records(self, start, end):
+        # Yields (offset, timestamp, body) for the complete records between the two offsets
+        if end <= start:
+            return
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ) as data:
+                offset = start
+                while offset + RECORD_HEADER.size <= end:
+                    ts, length = RECORD_HEADER.unpack_from(data, offset)
+                    bodyStart = offset + RECORD_HEADER.size
+                    if bodyStart + length > end:
+                        break
+                    yield offset, ts, data[bodyStart:bodyStart + length]
+                    offset = bodyStart + length
+
+    def addIndexEntry(self, ts, offset):
+        self.indexTimes.append(ts)
+        self.indexOffsets.append(offset)
+        self.lastIndexed = offset
+
+    def offsetFor(self, ts):
+        # Offset of the last index entry before ts; every record from ts onwards comes after it
+        position = bisect.bisect_left(self.indexTimes, ts) - 1
+        return self.indexOffsets[position] if position >= 0 else 0
+
+    def loadIndex(self):
+        with open(self.indexPath, 'rb') as f:
+            data = f.read()
+        for position in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            self.addIndexEntry(*INDEX_ENTRY.unpack_from(data, position))
+        self.size = os.path.getsize(self.path)
+
+    def rebuild(self):
+        # Scans the whole segment, drops a partly written record left by a crash and
+        # rewrites the index
+        fileSize = os.path.getsize(self.path)
+        self.indexTimes, self.indexOffsets, self.lastIndexed = [], [], None
+        end = 0
+        for offset, ts, body in self.records(0, fileSize):
+            if self.lastIndexed is None or offset - self.lastIndexed >= INDEX_INTERVAL:
+                self.addIndexEntry(ts, offset)
+            self.lastTs = ts
+            end = offset + RECORD_HEADER.size + len(body)
+        if end < fileSize:
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        self.size = end
+        with open(self.indexPath, 'wb') as f:
+            for ts, offset in zip(self.indexTimes, self.indexOffsets):
+                f.write(INDEX_ENTRY.pack(ts, offset))
+
+    def delete(self):
+        for path in (self.path, self.indexPath):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class EventStore:
+    def __init__(self, directory=EVENTSTORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.segments = []
+        self.writer = None
+        self.indexWriter = None
+        self.compactThread = None
+        self.counters = {"appended": 0, "queries": 0, "segments_compacted": 0, "bytes_compacted": 0}
+        self.load()
+
+    def load(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.log')))
+        for position, path in enumerate(paths):
+            segment = Segment(self.directory, int(os.path.basename(path)[:-4]))
+            if position == len(paths) - 1 or not os.path.exists(segment.indexPath):
+                segment.rebuild()
+            else:
+                segment.loadIndex()
+            self.segments.append(segment)
+        if self.segments:
+            self.openWriters(self.segments[-1])
+
+    def openWriters(self, segment):
+        self.writer = open(segment.path, 'ab')
+        self.indexWriter = open(segment.indexPath, 'ab')
+
+    def closeWriters(self):
+        for f in (self.writer, self.indexWriter):
+            if f is not None:
+                f.close()
+        self.writer = self.indexWriter = None
+
+    def rotate(self, ts):
+        self.closeWriters()
+        if self.segments:
+            # Names have to stay unique and ordered even if two segments start in the same ms
+            ts = max(ts, self.segments[-1].baseTs + 1)
+        segment = Segment(self.directory, ts)
+        self.segments.append(segment)
+        self.openWriters(segment)
+        return segment
+
+    def append(self, events):
+        # events: (timestamp in seconds, body bytes) pairs, written and flushed together
+        with self.lock:
+            for timestamp, body in events:
+                active = self.segments[-1] if self.segments else None
+                ts = int(timestamp * 1000)
+                if active is not None:
+                    # Keep each segment sorted by time even if the clock steps back
+                    ts = max(ts, active.lastTs)
+                if active is None or active.size >= SEGMENT_BYTES or ts - active.baseTs >= SEGMENT_SECONDS * 1000:
+                    active = self.rotate(ts)
+                offset = active.size
+                if active.lastIndexed is None or offset - active.lastIndexed >= INDEX_INTERVAL:
+                    self.indexWriter.write(INDEX_ENTRY.pack(ts, offset))
+                    active.addIndexEntry(ts, offset)
+                self.writer.write(RECORD_HEADER.pack(ts, len(body)) + body)
+                active.size += RECORD_HEADER.size + len(body)
+                active.lastTs = ts
+            if self.writer is not None:
+                self.writer.flush()
+                self.indexWriter.flush()
+                if FSYNC:
+                    os.fsync(self.writer.fileno())
+            self.counters["appended"] += len(events)
+
+    def query(self, start, end, limit):
+        # Returns up to limit (timestamp in seconds, body) pairs with start <= timestamp <= end
+        startTs, endTs = int(start * 1000), int(end * 1000)
+        with self.lock:
+            self.counters["queries"] += 1
+            ranges = []
+            for position, segment in enumerate(self.segments):
+                upper = self.segments[position + 1].baseTs if position + 1 < len(self.segments) else segment.lastTs
+                if segment.baseTs <= endTs and upper >= startTs:
+                    ranges.append((segment, segment.offsetFor(startTs), segment.size))
+        results = []
+        for segment, offset, size in ranges:
+            try:
+                for _, ts, body in segment.records(offset, size):
+                    if ts < startTs:
+                        continue
+                    if ts > endTs:
+                        break
+                    results.append((ts / 1000.0, body))
+                    if len(results) >= limit:
+                        return results, True
+            except FileNotFoundError:
+                continue  # Compacted away while the query was running
+        return results, False
+
+    def compact(self, now=None):
+        # Deletes sealed segments whose last event is older than the retention period
+        cutoff = int(((now or time.time()) - RETENTION_SECONDS) * 1000)
+        with self.lock:
+            expired = []
+            while len(self.segments) > 1 and self.segments[1].baseTs <= cutoff:
+                expired.append(self.segments.pop(0))
+            for segment in expired:
+                self.counters["segments_compacted"] += 1
+                self.counters["bytes_compacted"] += segment.size
+        for segment in expired:
+            segment.delete()
+        if expired:
+            print("Event store compacted", len(expired), "segments older than", RETENTION_SECONDS, "s")
+        return len(expired)
+
+    def start(self):
+        if self.compactThread is None:
+            self.compactThread = threading.Thread(target=self.compactLoop, name='eventstore-compact', daemon=True)
+            self.compactThread.start()
+
+    def compactLoop(self):
+        while True:
+            try:
+                self.compact()
+            except Exception as e:
+                print("Event store compaction error:", e)
+            time.sleep(COMPACT_INTERVAL)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters,
+                        segments=len(self.segments),
+                        bytes=sum(segment.size for segment in self.segments),
+                        index_entries=sum(len(segment.indexTimes) for segment in self.segments),
+                        oldest=self.segments[0].baseTs / 1000.0 if self.segments else None,
+                        newest=self.segments[-1].lastTs / 1000.0 if self.segments else None)
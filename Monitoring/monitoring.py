@@ -4,25 +4,288 @@
 
 import json
 import pika
-import os 
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
 
+from analytics import RateAnomalyDetector, SlidingTopK
+from eventstore import EventStore
+
+RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', '18.138.255.13')
+RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', '5672'))
+
+# Events are consumed in batches: a batch is processed and acked in one go once it holds
+# MONITORING_BATCH_SIZE events or MONITORING_BATCH_WINDOW seconds have passed
+BATCH_SIZE = int(os.getenv('MONITORING_BATCH_SIZE', '100'))
+BATCH_WINDOW = float(os.getenv('MONITORING_BATCH_WINDOW', '1'))
+WINDOW_SECONDS = int(os.getenv('MONITORING_WINDOW', '60'))
+METRICS_PORT = int(os.getenv('MONITORING_METRICS_PORT', '9103'))
+LOG_EVENTS = os.getenv('MONITORING_LOG_EVENTS', 'true').lower() == 'true'
+MAX_QUERY_EVENTS = 10000
+TOPK = int(os.getenv('MONITORING_TOPK', '10'))
+MAX_TOPK = 100
+
+#========= ROLLING WINDOWS =========#
+# One bucket per second in a ring of WINDOW_SECONDS buckets, so memory stays fixed and
+# a bucket is reused as soon as its second falls out of the window
+class RollingWindow:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.buckets = [None] * seconds
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def emptyBucket(second):
+        return {"second": second, "orders": 0, "notifications": 0,
+                "lagTotal": 0.0, "lagCount": 0, "lagMax": 0.0}
+
+    def bucket(self, now):
+        second = int(now)
+        index = second % self.seconds
+        current = self.buckets[index]
+        if current is None or current["second"] != second:
+            current = self.buckets[index] = self.emptyBucket(second)
+        return current
+
+    def record(self, order, lag, now):
+        with self.lock:
+            current = self.bucket(now)
+            if isOrder(order):
+                current["orders"] += 1
+            else:
+                current["notifications"] += 1
+            if lag is not None:
+                current["lagTotal"] += lag
+                current["lagCount"] += 1
+                current["lagMax"] = max(current["lagMax"], lag)
+
+    def summary(self, now):
+        oldest = int(now) - self.seconds
+        total = self.emptyBucket(None)
+        with self.lock:
+            for current in self.buckets:
+                if current is None or current["second"] <= oldest:
+                    continue
+                for key in ("orders", "notifications", "lagTotal", "lagCount"):
+                    total[key] += current[key]
+                total["lagMax"] = max(total["lagMax"], current["lagMax"])
+        return total
+
+window = RollingWindow(WINDOW_SECONDS)
+
+# Product demand and order-rate anomalies, both in fixed memory (see analytics.py)
+topProducts = SlidingTopK()
+orderRate = RateAnomalyDetector()
+
+# Totals since start, kept next to the windows for the counter-type metrics
+statsLock = threading.Lock()
+totals = {"orders": 0, "notifications": 0, "invalid": 0, "batches": 0, "batchedEvents": 0}
+
+# Every event is also persisted here before its batch is acked; opened in __main__
+eventStore = None
+
+def isOrder(order):
+    # Booking events come from sendMonitoring; notification.send events carry a 'from' address
+    return 'from' not in order
+
+def publishedAt(properties):
+    headers = properties.headers or {}
+    if 'x-published-at' in headers:
+        # Milliseconds since the epoch, as an integer (see placeOrders/outbox.py)
+        return int(headers['x-published-at']) / 1000.0
+    if properties.timestamp:
+        return float(properties.timestamp)
+    return None
+
+#========= HTTP ENDPOINTS =========#
+def renderMetrics():
+    now = time.time()
+    summary = window.summary(now)
+    perMinute = 60.0 / WINDOW_SECONDS
+    with statsLock:
+        current = dict(totals)
+    lines = [
+        "# HELP monitoring_orders_per_minute Booking events received over the rolling window, per minute.",
+        "# TYPE monitoring_orders_per_minute gauge",
+        "monitoring_orders_per_minute %s" % (summary["orders"] * perMinute),
+        "# HELP monitoring_notifications_per_minute Notification events received over the rolling window, per minute.",
+        "# TYPE monitoring_notifications_per_minute gauge",
+        "monitoring_notifications_per_minute %s" % (summary["notifications"] * perMinute),
+        "# HELP monitoring_product_demand Estimated units ordered of the top products over the top-K window.",
+        "# TYPE monitoring_product_demand gauge",
+    ]
+    for entry in topProducts.top(TOPK, now):
+        lines.append('monitoring_product_demand{product="%s"} %d' % (entry["product"].replace('"', '\\"'), entry["count"]))
+    rate = orderRate.state(now)
+    lines += [
+        "# HELP monitoring_order_rate_zscore Deviation of the last complete interval's order count from the expected count.",
+        "# TYPE monitoring_order_rate_zscore gauge",
+        "monitoring_order_rate_zscore %s" % rate["last_z"],
+        "# HELP monitoring_order_anomalies_total Order-rate anomalies detected since start.",
+        "# TYPE monitoring_order_anomalies_total counter",
+        "monitoring_order_anomalies_total %d" % rate["anomalies_total"],
+    ]
+    lines += [
+        "# HELP monitoring_event_lag_seconds End-to-end lag from publish to processing over the rolling window.",
+        "# TYPE monitoring_event_lag_seconds gauge",
+        'monitoring_event_lag_seconds{stat="avg"} %s' % (summary["lagTotal"] / summary["lagCount"] if summary["lagCount"] else 0.0),
+        'monitoring_event_lag_seconds{stat="max"} %s' % summary["lagMax"],
+        "# HELP monitoring_events_total Events processed since start.",
+        "# TYPE monitoring_events_total counter",
+        'monitoring_events_total{type="order"} %d' % current["orders"],
+        'monitoring_events_total{type="notification"} %d' % current["notifications"],
+        'monitoring_events_total{type="invalid"} %d' % current["invalid"],
+        "# HELP monitoring_batches_total Batches processed since start.",
+        "# TYPE monitoring_batches_total counter",
+        "monitoring_batches_total %d" % current["batches"],
+        "# HELP monitoring_batched_events_total Events processed in batches since start.",
+        "# TYPE monitoring_batched_events_total counter",
+        "monitoring_batched_events_total %d" % current["batchedEvents"],
+        "# HELP monitoring_window_seconds Length of the rolling window.",
+        "# TYPE monitoring_window_seconds gauge",
+        "monitoring_window_seconds %d" % WINDOW_SECONDS,
+    ]
+    return "\n".join(lines) + "\n"
+
+def parseTime(value):
+    # Epoch seconds, or an ISO 8601 time; times without an offset are the service's local time
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def queryEvents(params):
+    # /events?from=<time>&to=<time>&limit=<n>, defaulting to the last five minutes
+    now = time.time()
+    start = parseTime(params['from'][0]) if 'from' in params else now - 300
+    end = parseTime(params['to'][0]) if 'to' in params else now
+    limit = min(int(params.get('limit', ['1000'])[0]), MAX_QUERY_EVENTS)
+    found, truncated = eventStore.query(start, end, limit)
+    events = []
+    for timestamp, body in found:
+        try:
+            event = json.loads(body)
+        except ValueError:
+            event = body.decode('utf-8', 'replace')
+        events.append({"timestamp": timestamp, "event": event})
+    return {"from": start, "to": end, "count": len(events), "truncated": truncated, "events": events}
+
+class MonitoringHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            self.reply(200, renderMetrics(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif url.path == '/events' and eventStore is not None:
+            try:
+                result = queryEvents(parse_qs(url.query))
+            except ValueError as e:
+                self.reply(400, json.dumps({"error": str(e)}), 'application/json')
+                return
+            self.reply(200, json.dumps(result), 'application/json')
+        elif url.path == '/topProducts':
+            params = parse_qs(url.query)
+            try:
+                k = min(int(params.get('k', [str(TOPK)])[0]), MAX_TOPK)
+            except ValueError as e:
+                self.reply(400, json.dumps({"error": str(e)}), 'application/json')
+                return
+            result = {"window_seconds": topProducts.windowSeconds, "top": topProducts.top(k, time.time())}
+            self.reply(200, json.dumps(result), 'application/json')
+        elif url.path == '/orderAnomalies':
+            self.reply(200, json.dumps(orderRate.state(time.time())), 'application/json')
+        elif url.path == '/eventStoreStats' and eventStore is not None:
+            self.reply(200, json.dumps(eventStore.stats()), 'application/json')
+        else:
+            self.send_error(404)
+
+    def reply(self, status, text, contentType):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the event log
+
+def startHttpServer():
+    if not METRICS_PORT:
+        return
+    server = ThreadingHTTPServer(('0.0.0.0', METRICS_PORT), MonitoringHandler)
+    threading.Thread(target=server.serve_forever, name='http', daemon=True).start()
+    print("Serving /metrics and /events on port", METRICS_PORT)
+
+#========= CONSUMER =========#
 def receiveOrderLog():
-    hostname = "18.138.255.13"
-    port = 5672 
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=hostname, port=port))
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, port=RABBITMQ_PORT))
     channel = connection.channel()
 
     exchangename="order_topic"
     channel.exchange_declare(exchange=exchangename, exchange_type='topic')
     channel.queue_declare(queue='monitoring')
-    channel.queue_bind(exchange=exchangename, queue='monitoring', routing_key='#') 
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue='monitoring', on_message_callback=callback, auto_ack=True)
-    channel.start_consuming()     
-
-def callback(channel, method, properties, body):
-    processOrderLog(json.loads(body))
-    
+    channel.queue_bind(exchange=exchangename, queue='monitoring', routing_key='#')
+    # Enough prefetch for one batch to fill while the previous one is processed
+    channel.basic_qos(prefetch_count=2 * BATCH_SIZE)
+
+    batch = []
+    def callback(channel, method, properties, body):
+        batch.append((method.delivery_tag, properties, body))
+
+    channel.basic_consume(queue='monitoring', on_message_callback=callback, auto_ack=False)
+    batchStarted = None
+    while True:
+        connection.process_data_events(time_limit=BATCH_WINDOW)
+        if not batch:
+            continue
+        if batchStarted is None:
+            batchStarted = time.monotonic()
+        if len(batch) >= BATCH_SIZE or time.monotonic() - batchStarted >= BATCH_WINDOW:
+            processBatch(batch)
+            # One ack covers every delivery up to the last one in the batch
+            channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+            batch.clear()
+            batchStarted = None
+
+def processBatch(batch):
+    now = time.time()
+    if eventStore is not None:
+        # Persisted as received, invalid bodies included, before the batch is acked
+        eventStore.append([(now, body) for deliveryTag, properties, body in batch])
+    orders = notifications = invalid = 0
+    for deliveryTag, properties, body in batch:
+        try:
+            order = json.loads(body)
+        except ValueError:
+            invalid += 1
+            continue
+        if not isinstance(order, dict):
+            invalid += 1
+            continue
+        published = publishedAt(properties)
+        window.record(order, now - published if published is not None else None, now)
+        if isOrder(order):
+            orders += 1
+            orderRate.record(now)
+            for product in order.get('products', []):
+                topProducts.add(str(product), now)
+        else:
+            notifications += 1
+        if LOG_EVENTS:
+            try:
+                processOrderLog(order)
+            except (KeyError, TypeError) as e:
+                print("Could not log event, missing field:", e)
+    with statsLock:
+        totals["orders"] += orders
+        totals["notifications"] += notifications
+        totals["invalid"] += invalid
+        totals["batches"] += 1
+        totals["batchedEvents"] += len(batch)
+
 def processOrderLog(order):
     if 'from' not in order: 
         prods = ", ".join(str(x) for x in order['products'])
@@ -33,7 +296,7 @@ def processOrderLog(order):
         print ("Products: " + prods)
         print ("Comments: " + order['comments'])
         print ("Project Start Date: " + order['projStartDate'])
-
+        
     else:
         print("NOTIFICATION SENT")
         for x in order:
@@ -49,4 +312,7 @@ def processOrderLog(order):
 if __name__ == "__main__":  # execute this program only if it is run as a script (not by 'import')
     print("This is " + os.path.basename(__file__) + ": receiving message logs...")
     print()
-    receiveOrderLog()
\ No newline at end of file
+    eventStore = EventStore()
+    eventStore.start()
+    startHttpServer()
+    receiveOrderLog()
@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+import time
+
+from mailgun_stub import start_stub, stats
+
+# Compares one Mailgun call per message against micro-batched delivery, using the local
+# Mailgun stub instead of the real API. No RabbitMQ is needed.
+# Usage: python benchmark_batching.py [messages] [batch_size]
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+BATCH_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+server = start_stub()
+os.environ['MAILGUN_API_KEY'] = 'stub-key'
+os.environ['MAILGUN_BASE_URL'] = f'http://127.0.0.1:{server.server_port}/v3/stub/messages'
+os.environ['NOTIFICATION_METRICS_PORT'] = '0'
+
+import logging
+import notification
+
+logging.getLogger(notification.__name__).setLevel(logging.WARNING)
+
+def make_message(i: int) -> dict:
+    return {
+        "to": [f"customer{i}@example.com"],
+        "subject": "Booking ID: %recipient.bookingID% Congratulations! Your booking has been successfully made.",
+        "text": "Dear Valued Customer, \n\nYour payment was successful and payment has been confirmed.",
+        "recipient_variables": {"bookingID": i}
+    }
+
+def run_individual() -> float:
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        notification.send_notification(make_message(i))
+    return time.perf_counter() - start
+
+def run_batched() -> float:
+    done = threading.Semaphore(0)
+    batcher = notification.MailBatcher(BATCH_SIZE, 0.05)
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        batcher.add(make_message(i), done.release, lambda retryable: done.release())
+    for _ in range(MESSAGES):
+        done.acquire()
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    individual = run_individual()
+    calls_before = stats.json()["calls"]
+    batched = run_batched()
+    batch_calls = stats.json()["calls"] - calls_before
+    print(f"{MESSAGES} messages, stub latency {os.getenv('STUB_LATENCY', '0.2')}s")
+    print(f"One call per message: {individual:.2f}s, {MESSAGES / individual:.1f} emails/sec, {MESSAGES} calls")
+    print(f"Batched ({BATCH_SIZE}):      {batched:.2f}s, {MESSAGES / batched:.1f} emails/sec, {batch_calls} calls")
@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from urllib.parse import parse_qs
+
+# Local stand-in for the Mailgun messages API, used to benchmark notification delivery.
+# Every POST is answered after STUB_LATENCY seconds (default 0.2, roughly a Mailgun round
+# trip) and counted; GET /stats returns the totals.
+# Usage: python mailgun_stub.py [port]
+
+STUB_LATENCY = float(os.getenv('STUB_LATENCY', '0.2'))
+
+class StubStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.recipients = 0
+
+    def record(self, recipients: int) -> None:
+        with self.lock:
+            self.calls += 1
+            self.recipients += recipients
+
+    def json(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"calls": self.calls, "recipients": self.recipients}
+
+stats = StubStats()
+
+class MailgunStubHandler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        time.sleep(STUB_LATENCY)
+        stats.record(len(form.get('to', [])))
+        self._reply({"id": f"<{uuid.uuid4().hex}@stub>", "message": "Queued. Thank you."})
+
+    def do_GET(self) -> None:
+        if self.path != '/stats':
+            self.send_error(404)
+            return
+        self._reply(stats.json())
+
+    def _reply(self, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+def start_stub(port: int = 0) -> ThreadingHTTPServer:
+    """Start the stub on a daemon thread and return the server (port 0 picks a free port)."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MailgunStubHandler)
+    threading.Thread(target=server.serve_forever, name='mailgun-stub', daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8025
+    server = ThreadingHTTPServer(('0.0.0.0', port), MailgunStubHandler)
+    print(f"Mailgun stub listening on port {port}, latency {STUB_LATENCY}s")
+    server.serve_forever()
@@ -1,13 +1,23 @@
 import os
 import json
+import hashlib
 import logging
+import math
+import multiprocessing
 import pika
 import requests
+import signal
+import sqlite3
+import threading
 import time
-from functools import wraps
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from dotenv import load_dotenv
 from datetime import datetime
-from typing import Dict, Any, Tuple
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
 # Load environment variables
 load_dotenv()
@@ -22,13 +32,65 @@ logger = logging.getLogger(__name__)
 # Configuration
 MAILGUN_API_KEY = os.getenv('MAILGUN_API_KEY')
 MAILGUN_DOMAIN = os.getenv('MAILGUN_DOMAIN', 'sandbox2257105e012e438cab8c6547d9de3687.mailgun.org')
-MAILGUN_BASE_URL = f"https://api.mailgun.net/v3/{MAILGUN_DOMAIN}/messages"
+MAILGUN_BASE_URL = os.getenv('MAILGUN_BASE_URL', f"https://api.mailgun.net/v3/{MAILGUN_DOMAIN}/messages")
+DEFAULT_SENDER = f'B.Y. Solutions <noreply@{MAILGUN_DOMAIN}>'
 
 # Validate configuration
 if not MAILGUN_API_KEY:
     logger.error("MAILGUN_API_KEY environment variable is not set")
     raise ValueError("MAILGUN_API_KEY environment variable is required")
 
+# Consumer concurrency: with NOTIFICATION_CONCURRENCY > 1 deliveries are handed to a
+# bounded worker pool instead of being sent one at a time on the connection thread
+NOTIFICATION_CONCURRENCY = int(os.getenv('NOTIFICATION_CONCURRENCY', '1'))
+NOTIFICATION_PREFETCH = int(os.getenv('NOTIFICATION_PREFETCH', str(2 * NOTIFICATION_CONCURRENCY)))
+METRICS_PORT = int(os.getenv('NOTIFICATION_METRICS_PORT', '9102'))
+
+# Micro-batching: with NOTIFICATION_BATCH_SIZE > 1, messages sharing a template are
+# collected for up to NOTIFICATION_BATCH_WINDOW seconds and sent as one Mailgun call
+NOTIFICATION_BATCH_SIZE = min(int(os.getenv('NOTIFICATION_BATCH_SIZE', '1')), 1000)  # Mailgun's batch limit
+NOTIFICATION_BATCH_WINDOW = float(os.getenv('NOTIFICATION_BATCH_WINDOW', '0.5'))
+
+# Failed sends are retried through delay queues, one tier per attempt, before the message
+# is parked for inspection
+RETRY_DELAYS = [int(delay) for delay in os.getenv('NOTIFICATION_RETRY_DELAYS', '5,30,300').split(',')]
+RETRY_HEADER = 'x-retry-count'
+
+# Deduplication: a message whose ID was already sent within NOTIFICATION_DEDUP_TTL seconds,
+# or whose exact content was sent within NOTIFICATION_DEDUP_CONTENT_TTL seconds, is acked
+# and skipped. IDs catch broker redeliveries and outbox re-publishes; the short content
+# window only catches re-fired requests, so a legitimate repeat a minute later still goes
+# out. Sent keys are kept in an in-memory LRU backed by a SQLite file, so redeliveries
+# after a restart are caught too; a TTL of 0 disables that kind of key
+NOTIFICATION_DEDUP_PATH = os.getenv('NOTIFICATION_DEDUP_PATH', 'notification_dedup.sqlite3')
+NOTIFICATION_DEDUP_TTL = int(os.getenv('NOTIFICATION_DEDUP_TTL', '3600'))
+NOTIFICATION_DEDUP_CONTENT_TTL = int(os.getenv('NOTIFICATION_DEDUP_CONTENT_TTL', '60'))
+NOTIFICATION_DEDUP_SIZE = int(os.getenv('NOTIFICATION_DEDUP_SIZE', '10000'))
+
+# Multi-process mode: with NOTIFICATION_PROCESSES_MAX > 1 a supervisor runs between MIN and
+# MAX consumer processes, aiming for NOTIFICATION_SCALE_BACKLOG queued messages per process
+NOTIFICATION_PROCESSES_MIN = max(int(os.getenv('NOTIFICATION_PROCESSES_MIN', '1')), 1)
+NOTIFICATION_PROCESSES_MAX = max(int(os.getenv('NOTIFICATION_PROCESSES_MAX', str(NOTIFICATION_PROCESSES_MIN))),
+                                 NOTIFICATION_PROCESSES_MIN)
+NOTIFICATION_SCALE_BACKLOG = max(int(os.getenv('NOTIFICATION_SCALE_BACKLOG', '100')), 1)
+NOTIFICATION_SCALE_INTERVAL = float(os.getenv('NOTIFICATION_SCALE_INTERVAL', '15'))
+NOTIFICATION_DRAIN_TIMEOUT = float(os.getenv('NOTIFICATION_DRAIN_TIMEOUT', '30'))
+
+class DeliveryError(Exception):
+    """Raised when Mailgun did not accept a message."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        # Rate limiting, Mailgun outages and network errors (reported as 500) are transient
+        return is_retryable_status(self.status_code)
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
 def log_activity(message: str, level: str = 'info', **kwargs: Any) -> None:
     """Helper function for consistent logging."""
     log_entry = {
@@ -42,6 +104,234 @@ def log_activity(message: str, level: str = 'info', **kwargs: Any) -> None:
     else:
         logger.info(json.dumps(log_entry))
 
+class ConsumerMetrics:
+    """Thread-safe counters and gauges for the notification consumer."""
+
+    def __init__(self, rate_window: float = 60.0):
+        self.lock = threading.Lock()
+        self.rate_window = rate_window
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.sent_times: deque = deque()
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_gauge(self, name: str, delta: float) -> None:
+        with self.lock:
+            self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def record_sent(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.counters['emails_sent'] = self.counters.get('emails_sent', 0) + 1
+            self.sent_times.append(now)
+            self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        while self.sent_times and self.sent_times[0] < now - self.rate_window:
+            self.sent_times.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            self._trim(time.monotonic())
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'emails_per_second': len(self.sent_times) / self.rate_window
+            }
+
+metrics = ConsumerMetrics()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the consumer metrics as JSON on /metrics."""
+
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = json.dumps(metrics.snapshot()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # Keep scrapes out of the service log
+
+def start_metrics_server(port: int = METRICS_PORT) -> None:
+    """Serve /metrics from a daemon thread; a port of 0 disables it."""
+    if not port:
+        return
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    log_activity("Metrics endpoint started", port=port)
+
+def dedup_keys(properties: pika.spec.BasicProperties, message: Dict[str, Any]) -> List[Tuple[str, int]]:
+    """(key, ttl) pairs identifying a notification: its AMQP message ID and a hash of its content."""
+    keys = []
+    if properties.message_id and NOTIFICATION_DEDUP_TTL > 0:
+        keys.append((f'id:{properties.message_id}', NOTIFICATION_DEDUP_TTL))
+    if NOTIFICATION_DEDUP_CONTENT_TTL > 0:
+        canonical = json.dumps(message, sort_keys=True, separators=(',', ':'), default=str)
+        keys.append(('sha256:' + hashlib.sha256(canonical.encode('utf-8')).hexdigest(),
+                     NOTIFICATION_DEDUP_CONTENT_TTL))
+    return keys
+
+class DedupCache:
+    """
+    Remembers which notifications were sent so redelivered or re-fired duplicates are skipped.
+
+    A key is claimed before sending and completed once Mailgun accepted the message, or
+    released if the send failed so the retry can go out. Recent keys are answered from an
+    LRU in memory; older ones, and keys sent before a restart, from the SQLite store.
+    Each key expires after the TTL it was completed with.
+    """
+
+    PURGE_INTERVAL = 60  # seconds between sweeps of expired rows
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.recent: OrderedDict = OrderedDict()  # key -> expiry time
+        self.pending: set = set()
+        self.last_purge = 0.0
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sent (key TEXT PRIMARY KEY, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_sent_expires ON sent (expires)")
+
+    @contextmanager
+    def connect(self):
+        # A short-lived connection per call keeps the store safe to use from any worker thread
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _remember(self, key: str, expires: float) -> None:
+        self.recent[key] = expires
+        self.recent.move_to_end(key)
+        while len(self.recent) > self.max_entries:
+            self.recent.popitem(last=False)
+        metrics.set_gauge('dedup_cached', len(self.recent))
+
+    def claim(self, key: str) -> bool:
+        """Reserve `key` for sending; False if it was already sent or is being sent."""
+        now = time.time()
+        with self.lock:
+            if key in self.pending:
+                metrics.incr('dedup_hits_in_flight')
+                return False
+            expires = self.recent.get(key)
+            if expires is not None and expires > now:
+                self.recent.move_to_end(key)
+                metrics.incr('dedup_hits_memory')
+                return False
+            self.recent.pop(key, None)
+            self.pending.add(key)
+
+        try:
+            with self.connect() as conn:
+                row = conn.execute("SELECT expires FROM sent WHERE key = ? AND expires > ?", (key, now)).fetchone()
+        except sqlite3.Error as e:
+            # Sending a possible duplicate beats dropping a notification
+            log_activity("Dedup store lookup failed", level='error', error=str(e))
+            row = None
+        if row is not None:
+            with self.lock:
+                self.pending.discard(key)
+                self._remember(key, row[0])
+            metrics.incr('dedup_hits_store')
+            return False
+        metrics.incr('dedup_misses')
+        return True
+
+    def complete(self, key: str, ttl: int) -> None:
+        """Record `key` as sent for the next `ttl` seconds."""
+        now = time.time()
+        expires = now + ttl
+        try:
+            with self.connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO sent (key, expires) VALUES (?, ?)", (key, expires))
+                if now - self.last_purge >= self.PURGE_INTERVAL:
+                    self.last_purge = now
+                    conn.execute("DELETE FROM sent WHERE expires <= ?", (now,))
+        except sqlite3.Error as e:
+            # The message is out already; it is still remembered in memory
+            log_activity("Dedup store write failed", level='error', error=str(e))
+        with self.lock:
+            self.pending.discard(key)
+            self._remember(key, expires)
+
+    def release(self, key: str) -> None:
+        """Give up a claim after a failed send so a retry is not mistaken for a duplicate."""
+        with self.lock:
+            self.pending.discard(key)
+
+dedup: Optional[DedupCache] = None
+dedup_lock = threading.Lock()
+
+def dedup_cache() -> Optional[DedupCache]:
+    """The shared dedup cache, opened on first use; None when deduplication is disabled."""
+    global dedup
+    if dedup is None and (NOTIFICATION_DEDUP_TTL > 0 or NOTIFICATION_DEDUP_CONTENT_TTL > 0):
+        with dedup_lock:
+            if dedup is None:
+                dedup = DedupCache(NOTIFICATION_DEDUP_PATH, NOTIFICATION_DEDUP_SIZE)
+    return dedup
+
+def claim_delivery(properties: pika.spec.BasicProperties,
+                   message: Dict[str, Any],
+                   ack: Callable[[], None],
+                   nack: Callable[[bool], None]) -> Optional[Tuple[Callable[[], None], Callable[[bool], None]]]:
+    """
+    Claim a message for sending, acking and skipping it if it is a duplicate.
+
+    Returns the (ack, nack) pair to settle the send with, which also completes or releases
+    the claim, or None if the message was a duplicate and has been acked.
+    """
+    cache = dedup_cache()
+    if cache is None:
+        return ack, nack
+    keys = dedup_keys(properties, message)
+    claimed = []
+    for key, ttl in keys:
+        if not cache.claim(key):
+            for claimed_key, _ in claimed:
+                cache.release(claimed_key)
+            log_activity("Skipping duplicate notification", message_id=properties.message_id, dedup_key=key)
+            ack()
+            return None
+        claimed.append((key, ttl))
+
+    def claimed_ack() -> None:
+        for key, ttl in claimed:
+            cache.complete(key, ttl)
+        ack()
+
+    def claimed_nack(retryable: bool) -> None:
+        release_delivery(properties, message)
+        nack(retryable)
+
+    return claimed_ack, claimed_nack
+
+def release_delivery(properties: pika.spec.BasicProperties, message: Dict[str, Any]) -> None:
+    """Give up the claims claim_delivery took for a message."""
+    cache = dedup_cache()
+    if cache is not None:
+        for key, _ in dedup_keys(properties, message):
+            cache.release(key)
+
 def send_notification(data: Dict[str, Any]) -> Tuple[str, int]:
     """
     Send email notification using Mailgun API.
@@ -49,7 +339,7 @@ def send_notification(data: Dict[str, Any]) -> Tuple[str, int]:
     Args:
         data (dict): Dictionary containing email details
             Required keys: 'to', 'subject', 'text'
-            Optional keys: 'from', 'html', 'cc', 'bcc'
+            Optional keys: 'from', 'html', 'cc', 'bcc', 'recipient_variables'
     
     Returns:
         tuple: (status_message, status_code)
@@ -66,7 +356,7 @@ def send_notification(data: Dict[str, Any]) -> Tuple[str, int]:
         
         # Prepare email data
         email_data = {
-            'from': data.get('from', f'B.Y. Solutions <noreply@{MAILGUN_DOMAIN}>'),
+            'from': data.get('from', DEFAULT_SENDER),
             'to': data['to'],
             'subject': data['subject'],
             'text': data['text']
@@ -79,6 +369,10 @@ def send_notification(data: Dict[str, Any]) -> Tuple[str, int]:
             email_data['cc'] = data['cc']
         if 'bcc' in data:
             email_data['bcc'] = data['bcc']
+        if 'recipient_variables' in data:
+            # Fills the %recipient.<name>% placeholders of a templated message
+            email_data['recipient-variables'] = json.dumps(
+                {recipient_address(data): data['recipient_variables']})
         
         # Log the email being sent (without sensitive data)
         log_data = email_data.copy()
@@ -111,12 +405,148 @@ def send_notification(data: Dict[str, Any]) -> Tuple[str, int]:
         error_msg = f"Mailgun API request failed: {str(e)}"
         log_activity(error_msg, level='error', error_type=type(e).__name__)
         return f"Error: {str(e)}", 500
+    except ValueError as e:
+        log_activity(f"Invalid notification: {str(e)}", level='error')
+        return f"Error: {str(e)}", 400
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
         log_activity(error_msg, level='error', error_type=type(e).__name__)
         return f"Error: {str(e)}", 500
 
 
+def recipient_address(data: Dict[str, Any]) -> Optional[str]:
+    """Return the single 'to' address of a message, or None if it has several."""
+    to = data.get('to')
+    if isinstance(to, list):
+        to = to[0] if len(to) == 1 else None
+    return to if isinstance(to, str) else None
+
+def send_batch(template: Dict[str, Any], recipients: Dict[str, Dict[str, Any]]) -> Tuple[str, int]:
+    """
+    Send one templated email to many recipients with a single Mailgun call.
+
+    Args:
+        template (dict): 'from', 'subject', 'text' and optionally 'html'; may use
+            %recipient.<name>% placeholders
+        recipients (dict): Recipient address -> that recipient's variables
+
+    Returns:
+        tuple: (status_message, status_code)
+    """
+    # recipient-variables also makes Mailgun send each recipient a separate copy, so it is
+    # always set, even when the template has no placeholders
+    email_data = dict(template)
+    email_data['to'] = list(recipients)
+    email_data['recipient-variables'] = json.dumps(recipients)
+    try:
+        log_activity("Sending batch email notification",
+                    recipients=len(recipients),
+                    subject=template['subject'][:50])
+        response = requests.post(
+            MAILGUN_BASE_URL,
+            auth=("api", MAILGUN_API_KEY),
+            data=email_data,
+            timeout=10
+        )
+    except requests.exceptions.RequestException as e:
+        log_activity(f"Mailgun batch request failed: {str(e)}", level='error', error_type=type(e).__name__)
+        return f"Error: {str(e)}", 500
+
+    if response.status_code == 200:
+        metrics.incr('batches_sent')
+        for _ in recipients:
+            metrics.record_sent()
+        return "Successfully Sent", response.status_code
+    log_activity(f"Failed to send batch: {response.status_code} - {response.text}", level='error',
+                status_code=response.status_code, recipients=len(recipients))
+    return "Sending Failed", response.status_code
+
+class MailBatcher:
+    """
+    Groups messages that share a template into Mailgun batch sends.
+
+    A group is flushed when it reaches `max_size` recipients or has been open for
+    `window` seconds. Each message is acked once its batch has been accepted by
+    Mailgun, or failed (retried or parked) if the batch is rejected.
+    """
+
+    def __init__(self, max_size: int, window: float, senders: int = 1):
+        self.max_size = max_size
+        self.window = window
+        self.groups: Dict[Tuple, Dict[str, Any]] = {}
+        self.ready: deque = deque()
+        self.condition = threading.Condition()
+        self.sender_pool = ThreadPoolExecutor(max_workers=max(senders, 1), thread_name_prefix='batch')
+        threading.Thread(target=self._flusher, name='batch-flusher', daemon=True).start()
+
+    @staticmethod
+    def batch_key(message: Dict[str, Any]) -> Optional[Tuple]:
+        """Messages with the same key can share a Mailgun call; None means send alone."""
+        if any(field not in message for field in ('to', 'subject', 'text')):
+            return None
+        if 'cc' in message or 'bcc' in message or recipient_address(message) is None:
+            return None
+        return (message.get('from', DEFAULT_SENDER), message['subject'], message['text'], message.get('html'))
+
+    def add(self, message: Dict[str, Any], ack: Callable[[], None], nack: Callable[[bool], None]) -> bool:
+        """Queue a message for batching; returns False if it has to be sent on its own."""
+        key = self.batch_key(message)
+        if key is None:
+            return False
+        address = recipient_address(message)
+        with self.condition:
+            group = self.groups.get(key)
+            if group is not None and address in group['recipients']:
+                # Recipient variables are keyed by address, so a repeat starts a new batch
+                self.ready.append(self.groups.pop(key))
+                group = None
+            if group is None:
+                group = self.groups[key] = {'key': key, 'recipients': {}, 'settles': [], 'opened': time.monotonic()}
+            group['recipients'][address] = message.get('recipient_variables', {})
+            group['settles'].append((ack, nack))
+            if len(group['recipients']) >= self.max_size:
+                self.ready.append(self.groups.pop(key))
+            metrics.set_gauge('batched_pending', sum(len(g['settles']) for g in self.groups.values()))
+            self.condition.notify()
+        return True
+
+    def _flusher(self) -> None:
+        while True:
+            with self.condition:
+                while True:
+                    now = time.monotonic()
+                    for key in [k for k, g in self.groups.items() if g['opened'] + self.window <= now]:
+                        self.ready.append(self.groups.pop(key))
+                    if self.ready:
+                        break
+                    deadlines = [g['opened'] + self.window for g in self.groups.values()]
+                    self.condition.wait(min(deadlines) - now if deadlines else None)
+                batches = list(self.ready)
+                self.ready.clear()
+                metrics.set_gauge('batched_pending', sum(len(g['settles']) for g in self.groups.values()))
+                metrics.add_gauge('batches_sending', len(batches))
+            for batch in batches:
+                self.sender_pool.submit(self._send, batch)
+
+    def _send(self, batch: Dict[str, Any]) -> None:
+        sender, subject, text, html = batch['key']
+        template = {'from': sender, 'subject': subject, 'text': text}
+        if html is not None:
+            template['html'] = html
+        try:
+            _, status_code = send_batch(template, batch['recipients'])
+            if status_code != 200:
+                metrics.incr('emails_failed', len(batch['settles']))
+            for ack, nack in batch['settles']:
+                if status_code == 200:
+                    ack()
+                else:
+                    nack(is_retryable_status(status_code))
+        finally:
+            metrics.add_gauge('batches_sending', -1)
+
+batcher: Optional[MailBatcher] = None
+
 def setup_rabbitmq_connection() -> pika.BlockingConnection:
     """Set up and return a RabbitMQ connection with error handling."""
     try:
@@ -147,6 +577,19 @@ def setup_rabbitmq_connection() -> pika.BlockingConnection:
         log_activity(f"Failed to connect to RabbitMQ: {str(e)}", level='error')
         raise
 
+def consumer_prefetch() -> int:
+    """Prefetch count large enough to keep the workers and a full batch supplied."""
+    prefetch = max(NOTIFICATION_PREFETCH, NOTIFICATION_CONCURRENCY)
+    if NOTIFICATION_BATCH_SIZE > 1:
+        prefetch = max(prefetch, 2 * NOTIFICATION_BATCH_SIZE)
+    return prefetch
+
+def retry_queue_name(queue_name: str, delay: int) -> str:
+    return f'{queue_name}.retry.{delay}s'
+
+def parking_queue_name(queue_name: str) -> str:
+    return f'{queue_name}.parking'
+
 def setup_rabbitmq_infrastructure(channel: pika.adapters.blocking_connection.BlockingChannel) -> None:
     """Set up RabbitMQ exchanges, queues, and bindings."""
     try:
@@ -179,8 +622,35 @@ def setup_rabbitmq_infrastructure(channel: pika.adapters.blocking_connection.Blo
             routing_key=routing_key
         )
         
-        # Set quality of service
-        channel.basic_qos(prefetch_count=1)
+        # Delay queues: a failed message waits out the tier's TTL and is then dead-lettered
+        # straight back onto the notification queue through the default exchange
+        for delay in RETRY_DELAYS:
+            channel.queue_declare(
+                queue=retry_queue_name(queue_name, delay),
+                durable=True,
+                arguments={
+                    'x-message-ttl': delay * 1000,
+                    'x-dead-letter-exchange': '',
+                    'x-dead-letter-routing-key': queue_name
+                }
+            )
+        
+        # Parking queue: everything dead-lettered from the notification queue (rejected
+        # after the last retry, or expired by its TTL) ends up here instead of vanishing
+        channel.exchange_declare(
+            exchange=f'{exchange_name}_dlx',
+            exchange_type='topic',
+            durable=True
+        )
+        channel.queue_declare(queue=parking_queue_name(queue_name), durable=True)
+        channel.queue_bind(
+            exchange=f'{exchange_name}_dlx',
+            queue=parking_queue_name(queue_name),
+            routing_key='#'
+        )
+        
+        # Set quality of service; prefetch has to cover the worker pool and a full batch
+        channel.basic_qos(prefetch_count=consumer_prefetch())
         
         log_activity("RabbitMQ infrastructure set up successfully")
         
@@ -188,12 +658,40 @@ def setup_rabbitmq_infrastructure(channel: pika.adapters.blocking_connection.Blo
         log_activity(f"Failed to set up RabbitMQ infrastructure: {str(e)}", level='error')
         raise
 
+shutdown_requested = threading.Event()
+
+def request_shutdown(signum: int, frame: Any) -> None:
+    """Signal handler: stop taking deliveries and let start_consumer drain and return."""
+    shutdown_requested.set()
+
+def unsettled_deliveries() -> float:
+    """Deliveries handed to the worker pool or batcher whose ack or nack has not run yet."""
+    return metrics.snapshot()['gauges'].get('unsettled', 0)
+
+def drain_consumer(connection: pika.BlockingConnection,
+                   channel: pika.adapters.blocking_connection.BlockingChannel,
+                   consumer_tag: str) -> None:
+    """Cancel the consumer and keep servicing the connection until in-flight messages are settled."""
+    channel.basic_cancel(consumer_tag)
+    deadline = time.monotonic() + NOTIFICATION_DRAIN_TIMEOUT
+    # Acks from worker threads are run by process_data_events, so keep calling it
+    while unsettled_deliveries() > 0 and time.monotonic() < deadline:
+        connection.process_data_events(time_limit=0.2)
+    remaining = unsettled_deliveries()
+    if remaining:
+        # Whatever is left unacked is redelivered once the connection closes
+        log_activity("Drain timed out, leaving messages to be redelivered", level='error', unsettled=remaining)
+    else:
+        log_activity("In-flight messages settled, consumer stopped")
+
 def start_consumer() -> None:
     """Start the RabbitMQ consumer with reconnection logic."""
     max_retries = 5
     retry_delay = 5  # seconds
     
     for attempt in range(1, max_retries + 1):
+        if shutdown_requested.is_set():
+            return
         try:
             # Set up connection and channel
             connection = setup_rabbitmq_connection()
@@ -204,23 +702,35 @@ def start_consumer() -> None:
             
             # Set up consumer
             queue_name = os.getenv('RABBITMQ_QUEUE', 'notification')
-            channel.basic_consume(
+            if NOTIFICATION_BATCH_SIZE > 1:
+                on_message = partial(batching_callback, connection)
+            elif NOTIFICATION_CONCURRENCY > 1:
+                on_message = partial(pooled_callback, connection)
+            else:
+                on_message = callback_wrapper
+            consumer_tag = channel.basic_consume(
                 queue=queue_name,
-                on_message_callback=callback_wrapper,
+                on_message_callback=on_message,
                 auto_ack=False  # Manual acknowledgment
             )
             
-            log_activity("Notification service started. Waiting for messages...")
+            log_activity("Notification service started. Waiting for messages...",
+                        concurrency=NOTIFICATION_CONCURRENCY,
+                        batch_size=NOTIFICATION_BATCH_SIZE,
+                        prefetch=consumer_prefetch())
             
-            # Start consuming
-            channel.start_consuming()
+            # Consume until a shutdown is requested, then finish in-flight messages
+            while not shutdown_requested.is_set():
+                connection.process_data_events(time_limit=1)
+            drain_consumer(connection, channel, consumer_tag)
+            return
             
         except pika.exceptions.AMQPConnectionError as e:
             if attempt == max_retries:
                 log_activity(f"Failed to connect to RabbitMQ after {max_retries} attempts. Giving up.", level='error')
                 raise
             log_activity(f"Connection attempt {attempt} failed. Retrying in {retry_delay} seconds...", level='warning')
-            time.sleep(retry_delay)
+            shutdown_requested.wait(retry_delay)
             retry_delay *= 2  # Exponential backoff
             
         except Exception as e:
@@ -229,18 +739,63 @@ def start_consumer() -> None:
                 connection.close()
             if attempt == max_retries:
                 raise
-            time.sleep(retry_delay)
+            shutdown_requested.wait(retry_delay)
             
         finally:
             if 'connection' in locals() and connection.is_open:
                 connection.close()
 
 
-def callback_wrapper(channel: pika.adapters.blocking_connection.BlockingChannel, 
-                     method: pika.spec.Basic.Deliver, 
-                     properties: pika.spec.BasicProperties, 
-                     body: bytes) -> None:
-    """Wrapper for the callback function with error handling and message acknowledgment."""
+def fail_delivery(channel: pika.adapters.blocking_connection.BlockingChannel,
+                  method: pika.spec.Basic.Deliver,
+                  properties: pika.spec.BasicProperties,
+                  body: bytes,
+                  retryable: bool) -> None:
+    """
+    Settle a failed delivery without blocking the consumer.
+
+    Retryable failures are republished to the next delay queue with an incremented
+    retry count and the original is acked. Anything else, or a message that has used up
+    every tier, is rejected and dead-lettered into the parking queue.
+    """
+    headers = dict(properties.headers or {})
+    attempt = int(headers.get(RETRY_HEADER, 0))
+    if retryable and attempt < len(RETRY_DELAYS):
+        headers[RETRY_HEADER] = attempt + 1
+        queue_name = os.getenv('RABBITMQ_QUEUE', 'notification')
+        channel.basic_publish(
+            exchange='',
+            routing_key=retry_queue_name(queue_name, RETRY_DELAYS[attempt]),
+            body=body,
+            properties=pika.BasicProperties(
+                headers=headers,
+                delivery_mode=2,
+                message_id=properties.message_id,
+                content_type=properties.content_type
+            )
+        )
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        metrics.incr('retries_scheduled')
+        log_activity("Scheduled notification retry",
+                    message_id=properties.message_id,
+                    attempt=attempt + 1,
+                    delay=RETRY_DELAYS[attempt])
+        return
+
+    channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+    metrics.incr('parked')
+    log_activity("Parked notification", level='error',
+                message_id=properties.message_id,
+                attempts=attempt,
+                retryable=retryable)
+
+def handle_delivery(channel: pika.adapters.blocking_connection.BlockingChannel,
+                    method: pika.spec.Basic.Deliver,
+                    properties: pika.spec.BasicProperties,
+                    body: bytes,
+                    ack: Callable[[], None],
+                    nack: Callable[[bool], None]) -> None:
+    """Decode and process one delivery, then settle it through `ack` or `nack(retryable)`."""
     try:
         # Parse message body
         try:
@@ -248,14 +803,21 @@ def callback_wrapper(channel: pika.adapters.blocking_connection.BlockingChannel,
             log_activity("Received message", message_id=properties.message_id)
         except json.JSONDecodeError:
             log_activity("Failed to decode message body", level='error', body=body)
-            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            nack(False)
             return
         
+        # Skip messages that were already sent; the claim is settled along with the message
+        if isinstance(message, dict):
+            settles = claim_delivery(properties, message, ack, nack)
+            if settles is None:
+                return
+            ack, nack = settles
+        
         # Process the message
         callback(channel, method, properties, message)
         
         # Acknowledge message if no exceptions were raised
-        channel.basic_ack(delivery_tag=method.delivery_tag)
+        ack()
         
     except Exception as e:
         log_activity("Error processing message", 
@@ -263,8 +825,94 @@ def callback_wrapper(channel: pika.adapters.blocking_connection.BlockingChannel,
                     error=str(e), 
                     message_id=getattr(properties, 'message_id', 'unknown'))
         
-        # Negative acknowledgment - don't requeue to avoid poison messages
-        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        # Transient Mailgun failures go to a delay queue, everything else is parked
+        nack(isinstance(e, DeliveryError) and e.retryable)
+
+def callback_wrapper(channel: pika.adapters.blocking_connection.BlockingChannel, 
+                     method: pika.spec.Basic.Deliver, 
+                     properties: pika.spec.BasicProperties, 
+                     body: bytes) -> None:
+    """Wrapper for the callback function with error handling and message acknowledgment."""
+    handle_delivery(channel, method, properties, body,
+                    ack=lambda: channel.basic_ack(delivery_tag=method.delivery_tag),
+                    nack=partial(fail_delivery, channel, method, properties, body))
+
+worker_pool: Optional[ThreadPoolExecutor] = None
+
+def settle_threadsafe(connection: pika.BlockingConnection, settle: Callable[[], None]) -> None:
+    """Run an ack/nack on the connection thread; pika channels are not thread-safe."""
+    def run() -> None:
+        try:
+            settle()
+        finally:
+            # Only counted as settled once the ack/nack has actually run, so a draining
+            # consumer does not close the connection with acks still queued
+            metrics.add_gauge('unsettled', -1)
+
+    try:
+        connection.add_callback_threadsafe(run)
+    except Exception as e:
+        # The connection is gone; the broker will redeliver the message
+        metrics.add_gauge('unsettled', -1)
+        log_activity("Could not settle message, connection closed", level='error', error=str(e))
+
+def pooled_callback(connection: pika.BlockingConnection,
+                    channel: pika.adapters.blocking_connection.BlockingChannel,
+                    method: pika.spec.Basic.Deliver,
+                    properties: pika.spec.BasicProperties,
+                    body: bytes) -> None:
+    """Hand a delivery to the worker pool so the connection thread keeps consuming."""
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = ThreadPoolExecutor(max_workers=NOTIFICATION_CONCURRENCY, thread_name_prefix='notify')
+
+    tag = method.delivery_tag
+    ack = partial(settle_threadsafe, connection, partial(channel.basic_ack, delivery_tag=tag))
+    def nack(retryable: bool) -> None:
+        settle_threadsafe(connection, partial(fail_delivery, channel, method, properties, body, retryable))
+
+    def work() -> None:
+        try:
+            handle_delivery(channel, method, properties, body, ack, nack)
+        finally:
+            metrics.add_gauge('in_flight', -1)
+
+    metrics.add_gauge('in_flight', 1)
+    metrics.add_gauge('unsettled', 1)
+    worker_pool.submit(work)
+
+def batching_callback(connection: pika.BlockingConnection,
+                      channel: pika.adapters.blocking_connection.BlockingChannel,
+                      method: pika.spec.Basic.Deliver,
+                      properties: pika.spec.BasicProperties,
+                      body: bytes) -> None:
+    """Queue a delivery for a batched send, or hand it to the worker pool if it cannot batch."""
+    global batcher
+    if batcher is None:
+        batcher = MailBatcher(NOTIFICATION_BATCH_SIZE, NOTIFICATION_BATCH_WINDOW, NOTIFICATION_CONCURRENCY)
+
+    tag = method.delivery_tag
+    try:
+        message = json.loads(body)
+    except json.JSONDecodeError:
+        message = None
+    if isinstance(message, dict):
+        log_activity("Received message", message_id=properties.message_id, routing_key=method.routing_key)
+        ack = partial(settle_threadsafe, connection, partial(channel.basic_ack, delivery_tag=tag))
+        def nack(retryable: bool) -> None:
+            settle_threadsafe(connection, partial(fail_delivery, channel, method, properties, body, retryable))
+
+        # Counted before anything can settle it; the duplicate path acks straight away
+        metrics.add_gauge('unsettled', 1)
+        settles = claim_delivery(properties, message, ack, nack)
+        if settles is None:
+            return
+        if batcher.add(message, *settles):
+            return
+        # Sent on its own instead; handle_delivery claims it again
+        metrics.add_gauge('unsettled', -1)
+        release_delivery(properties, message)
+    pooled_callback(connection, channel, method, properties, body)
 
 def callback(channel: pika.adapters.blocking_connection.BlockingChannel, 
              method: pika.spec.Basic.Deliver, 
@@ -286,23 +934,177 @@ def callback(channel: pika.adapters.blocking_connection.BlockingChannel,
         result, status_code = send_notification(message)
         
         if status_code == 200:
+            metrics.record_sent()
             log_activity("Notification processed successfully", 
                         booking_id=booking_id,
                         status=result)
         else:
+            metrics.incr('emails_failed')
             log_activity("Failed to process notification", 
                         level='error',
                         booking_id=booking_id,
                         status=status_code,
                         error=result)
+            raise DeliveryError(status_code, result)
     
     except Exception as e:
         log_activity("Error in callback", 
                     level='error', 
                     error=str(e),
-                    message=message)
+                    notification=message)
         raise  # Re-raise to be caught by wrapper
 
+def run_consumer_process(slot: int) -> None:
+    """Entry point of a consumer process started by the Supervisor."""
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    if METRICS_PORT:
+        # The supervisor serves METRICS_PORT; each consumer gets the port after it
+        start_metrics_server(METRICS_PORT + 1 + slot)
+    log_activity("Consumer process started", slot=slot, pid=os.getpid())
+    start_consumer()
+
+class Supervisor:
+    """
+    Runs the notification consumer as several processes, each with its own connection.
+
+    A process that exits is restarted with exponential backoff. Every
+    NOTIFICATION_SCALE_INTERVAL seconds the notification queue depth is checked and the
+    process count moved between `min_processes` and `max_processes`: scaling up happens at
+    once, scaling down one process per interval. SIGTERM stops every process gracefully,
+    letting each finish its in-flight messages.
+    """
+
+    MAX_BACKOFF = 60  # seconds
+    HEALTHY_AFTER = 60  # a process that ran this long has its crash backoff reset
+
+    def __init__(self, min_processes: int, max_processes: int):
+        # Processes are spawned rather than forked, since the supervisor's own threads
+        # (metrics server, logging) could leave locks held in a forked child
+        self.context = multiprocessing.get_context('spawn')
+        self.min_processes = min_processes
+        self.max_processes = max_processes
+        self.target = min_processes
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.started: Dict[int, float] = {}
+        self.failures: Dict[int, int] = {}
+        self.next_start: Dict[int, float] = {}
+        self.retiring: set = set()
+        self.connection: Optional[pika.BlockingConnection] = None
+        self.stopping = threading.Event()
+
+    def start_process(self, slot: int) -> None:
+        process = self.context.Process(target=run_consumer_process, args=(slot,), name=f'notification-{slot}')
+        process.start()
+        self.processes[slot] = process
+        self.started[slot] = time.monotonic()
+        metrics.incr('processes_started')
+        log_activity("Started consumer process", slot=slot, pid=process.pid)
+
+    def reap(self) -> None:
+        """Collect exited processes and schedule restarts for the ones that are still wanted."""
+        now = time.monotonic()
+        for slot, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del self.processes[slot]
+            if slot in self.retiring or slot >= self.target:
+                self.retiring.discard(slot)
+                self.failures.pop(slot, None)
+                log_activity("Consumer process retired", slot=slot, exitcode=process.exitcode)
+                continue
+            if now - self.started[slot] >= self.HEALTHY_AFTER:
+                self.failures[slot] = 0
+            self.failures[slot] = self.failures.get(slot, 0) + 1
+            backoff = min(2 ** (self.failures[slot] - 1), self.MAX_BACKOFF)
+            self.next_start[slot] = now + backoff
+            metrics.incr('process_restarts')
+            log_activity("Consumer process exited, restarting", level='error',
+                        slot=slot, exitcode=process.exitcode, backoff=backoff)
+
+    def reconcile(self) -> None:
+        """Start missing processes below the target and retire the ones above it."""
+        now = time.monotonic()
+        for slot in range(self.target):
+            if slot not in self.processes and self.next_start.get(slot, 0) <= now:
+                self.start_process(slot)
+        for slot, process in self.processes.items():
+            if slot >= self.target and slot not in self.retiring:
+                self.retiring.add(slot)
+                process.terminate()  # SIGTERM, so the process drains before exiting
+        metrics.set_gauge('processes', len(self.processes))
+        metrics.set_gauge('processes_target', self.target)
+
+    def queue_depth(self) -> Optional[int]:
+        """Messages ready in the notification queue, or None if RabbitMQ cannot be reached."""
+        try:
+            if self.connection is None or self.connection.is_closed:
+                self.connection = setup_rabbitmq_connection()
+            channel = self.connection.channel()
+            try:
+                queue_name = os.getenv('RABBITMQ_QUEUE', 'notification')
+                return channel.queue_declare(queue=queue_name, passive=True).method.message_count
+            finally:
+                channel.close()
+        except Exception as e:
+            log_activity("Could not read queue depth", level='error', error=str(e))
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+            self.connection = None
+            return None
+
+    def autoscale(self) -> None:
+        depth = self.queue_depth()
+        if depth is None:
+            return
+        metrics.set_gauge('queue_depth', depth)
+        desired = min(max(math.ceil(depth / NOTIFICATION_SCALE_BACKLOG), self.min_processes), self.max_processes)
+        if desired > self.target:
+            target = desired
+        elif desired < self.target:
+            target = self.target - 1
+        else:
+            return
+        log_activity("Scaling consumer processes", queue_depth=depth, processes=self.target, target=target)
+        self.target = target
+
+    def stop(self, signum: int, frame: Any) -> None:
+        self.stopping.set()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        start_metrics_server()
+        log_activity("Supervisor started",
+                    min_processes=self.min_processes,
+                    max_processes=self.max_processes,
+                    scale_backlog=NOTIFICATION_SCALE_BACKLOG)
+        next_scale = time.monotonic()
+        while not self.stopping.is_set():
+            self.reap()
+            if self.max_processes > self.min_processes and time.monotonic() >= next_scale:
+                self.autoscale()
+                next_scale = time.monotonic() + NOTIFICATION_SCALE_INTERVAL
+            self.reconcile()
+            self.stopping.wait(1)
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        log_activity("Supervisor stopping", processes=len(self.processes))
+        for process in self.processes.values():
+            process.terminate()
+        deadline = time.monotonic() + NOTIFICATION_DRAIN_TIMEOUT + 5
+        for slot, process in self.processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                log_activity("Consumer process did not stop in time, killing it", level='error', slot=slot)
+                process.kill()
+                process.join()
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+        log_activity("Supervisor stopped")
+
 
 if __name__ == "__main__":
     import time
@@ -333,7 +1135,12 @@ if __name__ == "__main__":
                 environment=os.getenv('FLASK_ENV', 'development'))
     
     try:
-        start_consumer()
+        if NOTIFICATION_PROCESSES_MAX > 1:
+            Supervisor(NOTIFICATION_PROCESSES_MIN, NOTIFICATION_PROCESSES_MAX).run()
+        else:
+            signal.signal(signal.SIGTERM, request_shutdown)
+            start_metrics_server()
+            start_consumer()
     except KeyboardInterrupt:
         log_activity("Notification service stopped by user")
     except Exception as e:
@@ -1,9 +1,11 @@
-from payment import db
+from payment import app, db
 
 def create_database():
     print("Creating database tables...")
     try:
-        db.create_all()
+        # Flask-SQLAlchemy 3 needs an application context to reach the engine
+        with app.app_context():
+            db.create_all()
         print("Database tables created successfully!")
     except Exception as e:
         print(f"Error creating database: {str(e)}")
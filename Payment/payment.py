@@ -9,10 +9,13 @@
 import os
 import json
 import logging
+from datetime import datetime
 from functools import wraps
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 from flask_cors import CORS, cross_origin
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import SQLAlchemyError
 import paypalrestsdk
 from paypalrestsdk import Payment, ResourceNotFound
 
@@ -51,6 +54,93 @@ if not all(paypal_config.values()):
 
 paypalrestsdk.configure(paypal_config)
 
+# Database configuration for the local payment ledger
+try:
+    db_user = os.getenv('DB_USER')
+    db_password = os.getenv('DB_PASSWORD')
+    db_host = os.getenv('DB_HOST')
+    db_name = 'payment'
+
+    if not all([db_user, db_password, db_host]):
+        raise ValueError("Missing database configuration environment variables")
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+mysqlconnector://{db_user}:{db_password}@{db_host}:3306/{db_name}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_POOL_RECYCLE'] = 280
+    app.config['SQLALCHEMY_POOL_TIMEOUT'] = 20
+
+except Exception as e:
+    logger.error(f"Database configuration error: {e}")
+    raise
+
+db = SQLAlchemy(app)
+
+# PayPal payment states after which a payment can no longer change
+TERMINAL_STATES = ('approved', 'failed', 'canceled', 'expired')
+
+class PaymentLedger(db.Model):
+    """Local record of every payment created through this service."""
+    __tablename__ = 'payment_ledger'
+
+    payment_id = db.Column(db.String(64), primary_key=True)
+    state = db.Column(db.String(20), nullable=False)
+    items = db.Column(db.JSON, nullable=False)
+    total = db.Column(db.Numeric(10, 2), nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default='SGD')
+    payer_id = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+def extract_items(payment):
+    """Return the sanitized item list of a PayPal payment."""
+    item_list = []
+    for transaction in payment.transactions:
+        if hasattr(transaction, 'item_list') and hasattr(transaction.item_list, 'items'):
+            for item in transaction.item_list.items:
+                # Only include necessary fields
+                item_list.append({
+                    'name': getattr(item, 'name', ''),
+                    'quantity': getattr(item, 'quantity', 1),
+                    'price': getattr(item, 'price', 0.0),
+                    'currency': getattr(item, 'currency', 'SGD')
+                })
+    return item_list
+
+def ledger_entry(payment_id):
+    """Return the ledger entry for a payment, or None if it is unknown or the ledger is unavailable."""
+    try:
+        return db.session.get(PaymentLedger, payment_id)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Ledger lookup failed for payment {payment_id}, falling back to PayPal: {str(e)}")
+        return None
+
+def record_payment(payment, payer_id=None):
+    """
+    Insert or update the ledger entry for a PayPal payment.
+
+    A failed write is logged and otherwise ignored: the payment itself succeeded, and
+    reads fall back to PayPal for payments missing from the ledger.
+    """
+    try:
+        entry = db.session.get(PaymentLedger, payment.id)
+        if entry is None:
+            amount = payment.transactions[0].amount
+            entry = PaymentLedger(
+                payment_id=payment.id,
+                items=extract_items(payment),
+                total=sum(float(t.amount.total) for t in payment.transactions),
+                currency=amount.currency
+            )
+            db.session.add(entry)
+        entry.state = payment.state
+        if payer_id:
+            entry.payer_id = payer_id
+        db.session.commit()
+    except (SQLAlchemyError, AttributeError, IndexError) as e:
+        db.session.rollback()
+        logger.error(f"Could not record payment {getattr(payment, 'id', None)} in the ledger: {str(e)}")
+
 def json_response(func):
     """Decorator to standardize JSON responses and handle errors."""
     @wraps(func)
@@ -76,25 +166,19 @@ def get_items(paymentId):
         if not paymentId or not isinstance(paymentId, str):
             return {"error": "Invalid payment ID"}, 400
             
+        # Items never change after a payment is created, so the ledger answers directly
+        entry = ledger_entry(paymentId)
+        if entry is not None:
+            return {"items": entry.items}
+            
         # Retrieve payment details
         payment = Payment.find(paymentId)
         if not payment or not hasattr(payment, 'transactions') or not payment.transactions:
             return {"error": "Payment not found or has no transactions"}, 404
-            
-        # Extract and sanitize item list
-        item_list = []
-        for transaction in payment.transactions:
-            if hasattr(transaction, 'item_list') and hasattr(transaction.item_list, 'items'):
-                for item in transaction.item_list.items:
-                    # Only include necessary fields
-                    item_list.append({
-                        'name': getattr(item, 'name', ''),
-                        'quantity': getattr(item, 'quantity', 1),
-                        'price': getattr(item, 'price', 0.0),
-                        'currency': getattr(item, 'currency', 'SGD')
-                    })
         
-        return {"items": item_list}
+        # Payments created before the ledger existed are added on first lookup
+        record_payment(payment)
+        return {"items": extract_items(payment)}
         
     except ResourceNotFound:
         logger.warning(f"Payment not found: {paymentId}")
@@ -166,6 +250,7 @@ def create_payment():
         
         # Create payment and get approval URL
         if payment.create():
+            record_payment(payment)
             for link in payment.links:
                 if link.method == "REDIRECT":
                     return {
@@ -197,12 +282,27 @@ def execute_payment():
         if not payment_id or not payer_id:
             return {"error": "Missing paymentId or PayerID"}, 400
         
+        # A payment the ledger already knows to be final needs no PayPal round trip
+        entry = ledger_entry(payment_id)
+        if entry is not None and entry.state == 'approved':
+            return {
+                "status": "already_approved",
+                "payment_id": entry.payment_id,
+                "state": entry.state
+            }
+        if entry is not None and entry.state in TERMINAL_STATES:
+            return {
+                "status": "failed",
+                "error": f"Payment is {entry.state}"
+            }, 400
+        
         # Find and execute the payment
         payment = Payment.find(payment_id)
         if not payment:
             return {"error": "Payment not found"}, 404
             
         if payment.state == 'approved':
+            record_payment(payment)
             return {
                 "status": "already_approved",
                 "payment_id": payment.id,
@@ -211,6 +311,7 @@ def execute_payment():
             
         if payment.execute({"payer_id": payer_id}):
             logger.info(f"Payment {payment_id} executed successfully")
+            record_payment(payment, payer_id)
             return {
                 "status": "success",
                 "payment_id": payment.id,
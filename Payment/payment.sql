@@ -0,0 +1,14 @@
+CREATE DATABASE IF NOT EXISTS payment;
+USE payment;
+
+CREATE TABLE IF NOT EXISTS payment_ledger (
+    payment_id VARCHAR(64) NOT NULL,
+    state VARCHAR(20) NOT NULL,
+    items JSON NOT NULL,
+    total DECIMAL(10, 2) NOT NULL,
+    currency VARCHAR(3) NOT NULL DEFAULT 'SGD',
+    payer_id VARCHAR(64) NULL,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL,
+    PRIMARY KEY (payment_id)
+);
@@ -0,0 +1,72 @@
+import sys
+import time
+
+from sqlalchemy import text
+from product import db
+
+INDEX_NAME = "ix_product_productid"
+SAMPLE_LOOKUPS = 200
+
+# Adds a unique index on productID so the database enforces one row per product ID.
+# The composite primary key already leads with productID, so lookups are indexed before
+# and after; the before/after plan and latency report is there to confirm that.
+
+def find_index(conn):
+    # Any index whose leftmost column is productID can serve the lookup
+    rows = conn.execute(text(
+        "SELECT INDEX_NAME, NON_UNIQUE FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'product' "
+        "AND COLUMN_NAME = 'productID' AND SEQ_IN_INDEX = 1"
+    )).fetchall()
+    return {row[0]: not row[1] for row in rows}
+
+def verify_data(conn):
+    nulls = conn.execute(text("SELECT COUNT(*) FROM product WHERE productID IS NULL")).scalar()
+    duplicates = conn.execute(text(
+        "SELECT productID, COUNT(*) FROM product GROUP BY productID HAVING COUNT(*) > 1"
+    )).fetchall()
+    if nulls:
+        print(f"{nulls} product rows have no productID")
+    for pid, count in duplicates:
+        print(f"productID {pid} is used by {count} rows")
+    return not nulls and not duplicates
+
+def measure(conn, label):
+    ids = [row[0] for row in conn.execute(text("SELECT productID FROM product ORDER BY productID"))]
+    if not ids:
+        print(f"[{label}] product table is empty, nothing to measure")
+        return
+    result = conn.execute(text("EXPLAIN SELECT * FROM product WHERE productID = :pid"), {"pid": ids[0]})
+    plan = dict(zip(result.keys(), result.fetchone()))
+    start = time.perf_counter()
+    for i in range(SAMPLE_LOOKUPS):
+        conn.execute(text("SELECT * FROM product WHERE productID = :pid"), {"pid": ids[i % len(ids)]}).fetchall()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"[{label}] plan: type={plan['type']} key={plan['key']} rows={plan['rows']}")
+    print(f"[{label}] {SAMPLE_LOOKUPS} lookups by productID: {elapsed_ms:.1f} ms total, {elapsed_ms / SAMPLE_LOOKUPS:.3f} ms avg")
+
+def migrate():
+    print("Checking product table for a unique productID index...")
+    with db.engine.begin() as conn:
+        measure(conn, "before")
+
+        indexes = find_index(conn)
+        if INDEX_NAME in indexes:
+            print(f"Index {INDEX_NAME} already exists, nothing to do.")
+            return True
+        if not verify_data(conn):
+            print("productID is not unique in the live data, index not created.")
+            return False
+
+        print(f"Creating unique index {INDEX_NAME} on product (productID)...")
+        conn.execute(text(f"CREATE UNIQUE INDEX {INDEX_NAME} ON product (productID)"))
+        if INDEX_NAME not in find_index(conn):
+            print("Index creation could not be verified.")
+            return False
+        print("Index created successfully!")
+
+        measure(conn, "after")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if migrate() else 1)
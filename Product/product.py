@@ -1,10 +1,17 @@
 # /myapp/__init__.py
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS, cross_origin
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case
+from collections import Counter
 
+import bisect
 import json
+import re
 import requests
+import threading
+import time
+import uuid
 
 ############ Call Flask, Connect Flask to Database ############
 app = Flask(__name__)
@@ -26,6 +33,12 @@ class Product(db.Model):
 	quantity = db.Column(db.Integer, nullable=False)
 	price = db.Column(db.Float(precision=2))
 
+	# Lookups by productid were already indexed through the composite primary key, which
+	# leads with productID. The unique index (see migrate_productid_index.py) guarantees one
+	# row per productid, which is what allows the mapper to use it as the single-column identity
+	__table_args__ = (db.Index('ix_product_productid', 'productid', unique=True),)
+	__mapper_args__ = {'primary_key': [productid]}
+
 	def __init__(self, productid, productcat, productsubcat, productname, quantity, price):
 		self.productid = productid
 		self.productcat = productcat
@@ -45,40 +58,291 @@ class Product(db.Model):
 		self.quantity += 1
 		return True
 
+############ Catalog Cache ############
+class CatalogCache:
+	# Keeps the serialized catalog and its per-productcat slices in memory. Stock writes
+	# only bump the version; the next read rebuilds everything with a single query.
+	# The cache is per process, so each worker invalidates on its own writes only.
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.instance = uuid.uuid4().hex[:8]
+		self.version = 0
+		self.built_version = None
+		self.catalog = None
+		self.slices = {}
+		self.hits = 0
+		self.misses = 0
+		self.rebuilds = 0
+		self.last_rebuild_seconds = 0.0
+		self.total_rebuild_seconds = 0.0
+
+	def invalidate(self):
+		with self.lock:
+			self.version += 1
+
+	def etag(self, version):
+		return "{}-{}".format(self.instance, version)
+
+	def get(self, productcat=None):
+		with self.lock:
+			if self.built_version == self.version:
+				self.hits += 1
+			else:
+				self.misses += 1
+				self.rebuild()
+			if productcat is None:
+				return self.catalog, self.built_version
+			return self.slices.get(productcat, self.slices[None]), self.built_version
+
+	def rebuild(self):
+		start = time.perf_counter()
+		version = self.version
+		products = [product.json() for product in Product.query.all()]
+		grouped = {}
+		for product in products:
+			grouped.setdefault(product["productcat"], []).append(product)
+		self.catalog = json.dumps({"product": products})
+		self.slices = {cat: json.dumps({"products": items}) for cat, items in grouped.items()}
+		self.slices[None] = json.dumps({"products": []})
+		self.built_version = version
+		elapsed = time.perf_counter() - start
+		self.rebuilds += 1
+		self.last_rebuild_seconds = elapsed
+		self.total_rebuild_seconds += elapsed
+
+	def stats(self):
+		with self.lock:
+			lookups = self.hits + self.misses
+			return {
+				"version": self.version,
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_rate": self.hits / lookups if lookups else 0.0,
+				"rebuilds": self.rebuilds,
+				"last_rebuild_seconds": self.last_rebuild_seconds,
+				"total_rebuild_seconds": self.total_rebuild_seconds
+			}
+
+catalog_cache = CatalogCache()
+
+def cachedResponse(body, version):
+	response = Response(body, mimetype="application/json")
+	response.set_etag(catalog_cache.etag(version))
+	return response.make_conditional(request)
+
+############ Keyset Pagination / Streaming ############
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def productPage(after, limit):
+	query = Product.query.order_by(Product.productid)
+	if after is not None:
+		query = query.filter(Product.productid > after)
+	return query.limit(limit).all()
+
+def streamProducts(fmt):
+	# Walks the table in keyset order one page at a time, so only a single page of rows
+	# is ever held in memory no matter how large the catalog gets
+	def generate():
+		if fmt == "json":
+			yield '{"product": ['
+		after = None
+		first = True
+		while True:
+			page = productPage(after, MAX_PAGE_SIZE)
+			for product in page:
+				if fmt == "json":
+					yield ("" if first else ", ") + json.dumps(product.json())
+				else:
+					yield json.dumps(product.json()) + "\n"
+				first = False
+			if len(page) < MAX_PAGE_SIZE:
+				break
+			after = page[-1].productid
+		if fmt == "json":
+			yield "]}"
+	mimetype = "application/json" if fmt == "json" else "application/x-ndjson"
+	return Response(stream_with_context(generate()), mimetype=mimetype)
+
 @app.route("/product")
 def get_all_products():
-	return jsonify({"product":[product.json() for product in Product.query.all()]})
+	stream = request.args.get("stream")
+	if stream is not None:
+		if stream not in ("ndjson", "json"):
+			return jsonify({"error": "stream must be 'ndjson' or 'json'"}), 400
+		return streamProducts(stream)
+	if "limit" not in request.args and "after" not in request.args:
+		return cachedResponse(*catalog_cache.get())
+
+	try:
+		limit = min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+		after = request.args.get("after", type=int)
+		if limit < 1 or ("after" in request.args and after is None):
+			raise ValueError
+	except ValueError:
+		return jsonify({"error": "limit must be a positive integer and after a productid"}), 400
+	# Fetch one extra row to tell whether another page follows
+	page = productPage(after, limit + 1)
+	next_after = page[limit - 1].productid if len(page) > limit else None
+	return jsonify({"product": [product.json() for product in page[:limit]], "next": next_after})
 
 @app.route("/product/<string:productcat>")
 @cross_origin(supports_credentials=True)
 def get_available_products(productcat):
-	product_list = list()
-	for product in Product.query.filter_by(productcat=productcat):
-		product_list.append(product)
-	return jsonify({"products":[product.json() for product in product_list]})
+	return cachedResponse(*catalog_cache.get(productcat))
+
+@app.route("/catalogCacheStats")
+def get_catalog_cache_stats():
+	return jsonify(catalog_cache.stats())
+
+############ Product Search Index ############
+class SearchIndex:
+	# Token prefix search over productname/productsubcat with category facets. Tokens are
+	# kept in a sorted list so a prefix is a bisect range; the index is built once and
+	# then kept current from the stock adjustments, so a search never touches MySQL.
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.products = {}
+		self.tokens = []
+		self.built = False
+
+	@staticmethod
+	def tokenize(text):
+		return [token for token in re.split(r"[^a-z0-9]+", text.lower()) if token]
+
+	def build(self):
+		products = {product.productid: product.json() for product in Product.query.all()}
+		tokens = set()
+		for pid, product in products.items():
+			for token in self.tokenize(product["productname"] + " " + product["productsubcat"]):
+				tokens.add((token, pid))
+		with self.lock:
+			self.products = products
+			self.tokens = sorted(tokens)
+			self.built = True
+
+	def update_quantities(self, quantities):
+		with self.lock:
+			for pid, quantity in quantities.items():
+				if pid in self.products:
+					self.products[pid]["quantity"] = quantity
+
+	def prefix_matches(self, prefix):
+		start = bisect.bisect_left(self.tokens, (prefix,))
+		matches = set()
+		for token, pid in self.tokens[start:]:
+			if not token.startswith(prefix):
+				break
+			matches.add(pid)
+		return matches
+
+	def search(self, query, productcat=None, productsubcat=None, in_stock=False):
+		if not self.built:
+			self.build()
+		with self.lock:
+			matches = set(self.products)
+			for prefix in self.tokenize(query):
+				matches &= self.prefix_matches(prefix)
+			if in_stock:
+				matches = {pid for pid in matches if self.products[pid]["quantity"] > 0}
+
+			# Facets describe the text matches, so the frontend can offer the other
+			# categories even after one has been selected
+			categories = Counter(self.products[pid]["productcat"] for pid in matches)
+			subcategories = Counter(self.products[pid]["productsubcat"] for pid in matches)
+
+			results = []
+			for pid in sorted(matches):
+				product = self.products[pid]
+				if productcat and product["productcat"] != productcat:
+					continue
+				if productsubcat and product["productsubcat"] != productsubcat:
+					continue
+				results.append(dict(product))
+		return {"products": results, "facets": {"productcat": categories, "productsubcat": subcategories}}
+
+search_index = SearchIndex()
+
+@app.route("/searchProduct")
+@cross_origin(supports_credentials=True)
+def search_products():
+	return jsonify(search_index.search(
+		request.args.get("q", ""),
+		productcat=request.args.get("productcat"),
+		productsubcat=request.args.get("productsubcat"),
+		in_stock=request.args.get("in_stock", "false").lower() == "true"))
+
+############ Batched Inventory Adjustment ############
+def parseProductList(data):
+	# placeOrders sends a JSON-encoded string, handleOrders sends the object itself
+	if isinstance(data, str):
+		data = json.loads(data)
+	if not isinstance(data, dict) or not isinstance(data.get('products'), list):
+		return None
+	try:
+		return [int(pid) for pid in data['products']]
+	except (TypeError, ValueError):
+		return None
+
+def adjustProductQty(product_list, sign):
+	# Each product ID may appear several times in an order, so collapse them into per-ID
+	# counts and apply the whole batch as one conditional UPDATE. A decrement only matches
+	# rows with enough stock, so if fewer rows match than were requested the batch is
+	# rolled back as a whole and nothing is oversold.
+	counts = Counter(product_list)
+	if not counts:
+		return True, []
+	delta = case(counts, value=Product.productid)
+	query = Product.query.filter(Product.productid.in_(counts.keys()))
+	if sign < 0:
+		query = query.filter(Product.quantity >= delta)
+	try:
+		updated = query.update({Product.quantity: Product.quantity + sign * delta}, synchronize_session=False)
+		success = updated == len(counts)
+		if not success:
+			db.session.rollback()
+		quantities = dict(db.session.query(Product.productid, Product.quantity).filter(Product.productid.in_(counts.keys())))
+		db.session.commit()
+	except Exception:
+		db.session.rollback()
+		raise
+	if success:
+		catalog_cache.invalidate()
+		search_index.update_quantities(quantities)
+
+	results = []
+	for pid, count in counts.items():
+		if pid not in quantities:
+			status = "not_found"
+		elif not success and sign < 0 and quantities[pid] < count:
+			status = "insufficient"
+		elif not success:
+			status = "rolled_back"
+		else:
+			status = "ok"
+		results.append({"productid": pid, "requested": count, "quantity": quantities.get(pid), "status": status})
+	return success, results
 
 @app.route("/updateProductQty", methods=["PUT"])
 def minusProductQty ():
-	data = request.get_json()
-	data = json.loads(data)	
-	product_list = data['products']
-	for pid in product_list:
-		pdt = Product.query.filter_by(productid = pid).first()
-		pdt.reduceQty()
-	db.session.commit()
-	return jsonify({"message":"true"})
+	product_list = parseProductList(request.get_json())
+	if product_list is None:
+		return jsonify({"message":"false", "error": "Expected a list of product IDs"}), 400
+	success, results = adjustProductQty(product_list, -1)
+	if success:
+		return jsonify({"message":"true", "results": results})
+	return jsonify({"message":"false", "results": results}), 409
 
 @app.route("/addProductQty", methods=["GET", "PUT"])
 def addProductQty ():
-	data = request.get_json()
-	print (data)
-	print (type(data))
-	product_list = data['products']
-	for pid in product_list:
-		pdt = Product.query.filter_by(productid = pid).first()
-		pdt.addQty()
-	db.session.commit()
-	return jsonify({"message":"true"})
+	product_list = parseProductList(request.get_json())
+	if product_list is None:
+		return jsonify({"message":"false", "error": "Expected a list of product IDs"}), 400
+	success, results = adjustProductQty(product_list, 1)
+	if success:
+		return jsonify({"message":"true", "results": results})
+	return jsonify({"message":"false", "results": results}), 409
 
 if __name__=='__main__':
+	search_index.build()
 	app.run(host="0.0.0.0", port=5150, debug=False)
@@ -10,7 +10,8 @@ CREATE TABLE product (
     productName VARCHAR(50) NOT NULL,
     quantity INT,
     price DOUBLE,
-    PRIMARY KEY (productID, productCat, productSubCat, productName)
+    PRIMARY KEY (productID, productCat, productSubCat, productName),
+    UNIQUE KEY ix_product_productid (productID)
 ); 
 
                                                                                  -- Productcat,   productsubcat, product name,) 
@@ -1,30 +1,131 @@
 from flask import Flask, request, jsonify, redirect
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS, cross_origin
-import requests
 
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from httpclient import client, POOL_MAXSIZE
 
 app = Flask(__name__)
 CORS(app)
 
+# Polled views are coalesced: concurrent requests for the same key share one upstream
+# call, results are served fresh for COALESCE_TTL seconds, and for a further
+# COALESCE_STALE_TTL seconds a stale result is served while one background refresh runs.
+# At most COALESCE_MAX_ENTRIES results are kept, evicting the least recently loaded.
+# invalidate() also retires a load already in flight for the key, so a load that started
+# before an update cannot write the old value back.
+COALESCE_TTL = float(os.getenv('COALESCE_TTL', '2'))
+COALESCE_STALE_TTL = float(os.getenv('COALESCE_STALE_TTL', '10'))
+COALESCE_MAX_ENTRIES = 10000
+
+class CoalescingCache:
+    def __init__(self, ttl, staleTtl):
+        self.ttl = ttl
+        self.staleTtl = staleTtl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.refreshPool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='refresh')
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "errors": 0,
+                         "evictions": 0, "discarded": 0}
+
+    def get(self, key, loader):
+        with self.lock:
+            entry = self.entries.get(key)
+            age = time.monotonic() - entry[1] if entry else None
+            if entry and age < self.ttl:
+                self.counters["hits"] += 1
+                return entry[0]
+            if entry and age < self.ttl + self.staleTtl:
+                self.counters["stale_hits"] += 1
+                if key not in self.inflight:
+                    self.counters["refreshes"] += 1
+                    future = self.inflight[key] = Future()
+                    self.refreshPool.submit(self.load, key, loader, future)
+                return entry[0]
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                self.counters["misses"] += 1
+                future = self.inflight[key] = Future()
+            else:
+                self.counters["coalesced"] += 1
+        if leader:
+            return self.load(key, loader, future)
+        return future.result()
+
+    def load(self, key, loader, future):
+        try:
+            value = loader()
+        except Exception as e:
+            with self.lock:
+                self.counters["errors"] += 1
+                if self.inflight.get(key) is future:
+                    del self.inflight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            # The in-flight future is the load's generation: if invalidate() retired it,
+            # the value may predate the update, so it is handed to the callers that were
+            # already waiting but not cached
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+                self.entries.pop(key, None)
+                self.entries[key] = (value, time.monotonic())
+                while len(self.entries) > COALESCE_MAX_ENTRIES:
+                    self.entries.popitem(last=False)
+                    self.counters["evictions"] += 1
+            else:
+                self.counters["discarded"] += 1
+        future.set_result(value)
+        return value
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+                self.inflight.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), in_flight=len(self.inflight), ttl=self.ttl, stale_ttl=self.staleTtl)
+
+coalescer = CoalescingCache(COALESCE_TTL, COALESCE_STALE_TTL)
+
+@app.route("/httpClientStats", methods=['GET'])
+def httpClientStats():
+    return jsonify(client.stats())
+
+@app.route("/coalescingStats", methods=['GET'])
+def coalescingStats():
+    return jsonify(coalescer.stats())
+
+def loadProductProgress(username):
+    r = client.get("http://13.250.108.137:8000/booking/productprogress/" + username)
+    if r.status_code == 200:
+        return json.loads(r.text)
+    return False
+
 @app.route("/productprogress/<string:username>", methods=['GET'])
 @cross_origin(supports_credentials=True)
 def UserProductProgress(username):
-    # print(username)
-    r = requests.get("http://13.250.108.137:8000/booking/productprogress/" + username)
-    if r.status_code == 200:
-        bookinginfo = json.loads(r.text)
-        return jsonify(bookinginfo)
-    else: 
-        return jsonify(False)
+    bookinginfo = coalescer.get(("productprogress", username), lambda: loadProductProgress(username))
+    return jsonify(bookinginfo)
+
+def loadBookingInformation(bookingID):
+    r = client.get("http://13.250.108.137:8000/booking/getinformation/" + bookingID)
+    return json.loads(r.text)
 
 @app.route("/vieworders/<string:bookingID>", methods=['GET'])
 @cross_origin(supports_credentials=True)
 def viewOrders(bookingID):
-    r = requests.get("http://13.250.108.137:8000/booking/getinformation/" + bookingID)
-    bookingInformation = json.loads(r.text)
-    # print (bookingInformation)
+    bookingInformation = coalescer.get(("vieworders", bookingID), lambda: loadBookingInformation(bookingID))
     return jsonify(bookingInformation)
 
 @app.route("/updateorders/<string:bookingID>/<string:productProgress>/<string:comments>", methods=['GET','PUT'])
@@ -32,21 +133,70 @@ def viewOrders(bookingID):
 def updateOrder(bookingID, productProgress,comments):
     pp = {"productProgress": productProgress, "comments":comments}
     pp = json.loads(json.dumps(pp,default=str))
-    r = requests.put("http://13.250.108.137:8000/booking/productprogress/" + bookingID, json = pp)
+    r = client.put("http://13.250.108.137:8000/booking/productprogress/" + bookingID, json = pp)
     if r.status_code == 200:      
         bookingInformation = json.loads(r.text)
-        bookingInformation   = jsonify(bookingInformation)
+        coalescer.invalidate(("vieworders", bookingID), ("productprogress", bookingInformation.get("username")))
         return jsonify({"msg":"true"})
     else: 
         return jsonify({"msg":"false"})
 
 @app.route("/updateProducts/<string:bookingID>", methods=["GET"])
 def getProducts(bookingID):
-    products = requests.get("http://13.250.108.137:8000/booking/getproducts/" + bookingID)
+    products = client.get("http://13.250.108.137:8000/booking/getproducts/" + bookingID)
     products = products.json()
-    update = requests.put("http://13.250.108.137:8000/product/addproductqty", json = products)
+    update = client.put("http://13.250.108.137:8000/product/addproductqty", json = products)
     print (update)
     return jsonify (True)
 
+# Independent downstream calls are issued concurrently on a shared pool, so a view that
+# needs N bookings waits for roughly the slowest call instead of the sum of all of them.
+# The pool size bounds the calls in flight across all requests to this service; it
+# defaults to the HTTP client's per-host pool, so a 20-booking view is one round of calls
+# and every call gets a kept-alive connection. With products=true the view is served by a
+# single /bookingsWithProducts call instead.
+FANOUT_MAX_IN_FLIGHT = int(os.getenv('FANOUT_MAX_IN_FLIGHT', str(POOL_MAXSIZE)))
+MAX_BOOKINGS_PER_VIEW = 100
+fanoutPool = ThreadPoolExecutor(max_workers=FANOUT_MAX_IN_FLIGHT, thread_name_prefix='fanout')
+
+def fetchJson(url):
+    try:
+        r = client.get(url)
+    except Exception as e:
+        return None, str(e)
+    if r.status_code != 200:
+        return None, "HTTP " + str(r.status_code)
+    return r.json(), None
+
+def fanout(urls):
+    return list(fanoutPool.map(fetchJson, urls))
+
+@app.route("/viewmultipleorders", methods=['GET'])
+@cross_origin(supports_credentials=True)
+def viewMultipleOrders():
+    bookingIDs = [bid for bid in request.args.get("ids", "").split(",") if bid.strip().isdigit()]
+    bookingIDs = [bid.strip() for bid in bookingIDs][:MAX_BOOKINGS_PER_VIEW]
+    if request.args.get("products", "false").lower() == "true":
+        return jsonify({"orders": bookingsWithProducts(bookingIDs)})
+    results = fanout(["http://13.250.108.137:8000/booking/getinformation/" + bid for bid in bookingIDs])
+
+    orders = []
+    for bid, (info, error) in zip(bookingIDs, results):
+        if error is not None:
+            orders.append({"bookingID": int(bid), "error": error})
+            continue
+        orders.append(info)
+    return jsonify({"orders": orders})
+
+def bookingsWithProducts(bookingIDs):
+    if not bookingIDs:
+        return []
+    result, error = fetchJson("http://13.250.108.137:8000/booking/bookingsWithProducts?ids=" + ",".join(bookingIDs))
+    if error is not None:
+        return [{"bookingID": int(bid), "error": error} for bid in bookingIDs]
+    bookings = {booking["bookingID"]: booking for booking in result["bookings"]}
+    # Same shape as the per-booking calls: one entry per requested ID, in request order
+    return [bookings.get(int(bid), {"bookingID": int(bid), "error": "HTTP 404"}) for bid in bookingIDs]
+
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5044, debug=True)
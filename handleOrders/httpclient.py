@@ -0,0 +1,89 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Outbound HTTP client shared by the composite services. Every downstream call goes
+# through one requests.Session, so connections to each host are pooled and kept alive
+# instead of opening a new TCP connection per call, and every call gets a timeout.
+# The same module ships in placeOrders/ and handleOrders/, since each image is built
+# from its own directory.
+
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3'))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '20'))
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+
+# Only retry methods that are safe to repeat. PUT is idempotent in theory, but the
+# product quantity endpoints adjust stock relative to its current value.
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class PooledClient:
+    def __init__(self):
+        retry = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=RETRY_METHODS,
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+        host = urlsplit(url).netloc
+        with self.lock:
+            stats = self.hosts.setdefault(host, {"requests": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0})
+            stats["requests"] += 1
+            stats["in_flight"] += 1
+            stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self.lock:
+                stats["errors"] += 1
+            raise
+        finally:
+            with self.lock:
+                stats["in_flight"] -= 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def stats(self):
+        # num_connections counts every connection a pool has opened, so it staying close
+        # to peak_in_flight means connections are being reused rather than re-created
+        opened = {}
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                opened["{}:{}".format(pool.host, pool.port)] = pool.num_connections
+        with self.lock:
+            hosts = {host: dict(stats) for host, stats in self.hosts.items()}
+        return {
+            "pool_maxsize": POOL_MAXSIZE,
+            "connect_timeout": CONNECT_TIMEOUT,
+            "read_timeout": READ_TIMEOUT,
+            "max_retries": MAX_RETRIES,
+            "hosts": hosts,
+            "connections_opened": opened
+        }
+
+
+client = PooledClient()
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pika
+
+# Durable outbox for the events placeOrders sends to order_topic. The request path only
+# appends the event to a local SQLite file; a relay thread drains the outbox to RabbitMQ
+# in batches and retries with backoff, so a slow or unavailable broker neither stalls the
+# request nor loses the event. Point OUTBOX_PATH at a mounted volume so pending events
+# survive a container restart.
+#
+# Every event gets a message_id when it is added. It is stored with the row and sent on
+# every publish attempt, so consumers can tell a re-published or redelivered event apart
+# from a new one with the same content.
+
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'outbox.sqlite3')
+RELAY_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+RELAY_INTERVAL = float(os.getenv('OUTBOX_RELAY_INTERVAL', '1'))
+MAX_BACKOFF = 60
+
+
+def eventProperties(persistent, created, messageID):
+    # x-published-at carries the creation time in integer milliseconds, for end-to-end lag
+    # in Monitoring. AMQP tables have no float type pika can encode, so it can't be the
+    # float itself
+    return pika.BasicProperties(delivery_mode=2 if persistent else None, timestamp=int(created),
+                                message_id=messageID, headers={'x-published-at': int(created * 1000)})
+
+
+class Outbox:
+    def __init__(self, path, publisher):
+        self.path = path
+        self.publisher = publisher
+        self.wakeup = threading.Event()
+        self.relayThread = None
+        self.statsLock = threading.Lock()
+        self.counters = {"enqueued": 0, "relayed": 0, "relay_failures": 0, "last_relay_lag_seconds": 0.0}
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, routing_key TEXT NOT NULL, body TEXT NOT NULL, "
+                "persistent INTEGER NOT NULL, created REAL NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, message_id TEXT)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(events)")]
+            if 'message_id' not in columns:
+                # Outbox files from before message IDs: give the pending rows one now
+                conn.execute("ALTER TABLE events ADD COLUMN message_id TEXT")
+                conn.execute("UPDATE events SET message_id = lower(hex(randomblob(16))) WHERE message_id IS NULL")
+
+    @contextmanager
+    def connect(self):
+        # A short-lived connection per call keeps the outbox safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, routingKey, body, persistent=False):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT INTO events (routing_key, body, persistent, created, next_attempt, message_id) VALUES (?, ?, ?, ?, ?, ?)",
+                (routingKey, body, int(persistent), now, now, uuid.uuid4().hex))
+        with self.statsLock:
+            self.counters["enqueued"] += 1
+        self.wakeup.set()
+
+    def start(self):
+        if self.relayThread is None:
+            self.relayThread = threading.Thread(target=self.relay, name='outbox-relay', daemon=True)
+            self.relayThread.start()
+
+    def relay(self):
+        while True:
+            self.wakeup.wait(RELAY_INTERVAL)
+            self.wakeup.clear()
+            try:
+                while self.relayBatch() == RELAY_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print ("Outbox relay error:", e)
+
+    def relayBatch(self):
+        with self.connect() as conn:
+            events = conn.execute(
+                "SELECT id, routing_key, body, persistent, created, attempts, message_id FROM events "
+                "WHERE next_attempt <= ? ORDER BY id LIMIT ?", (time.time(), RELAY_BATCH_SIZE)).fetchall()
+        relayed = []
+        for eventID, routingKey, body, persistent, created, attempts, messageID in events:
+            properties = eventProperties(persistent, created, messageID)
+            try:
+                self.publisher.publish(routingKey, body, properties=properties)
+            except Exception as e:
+                # Stop at the first failure: the broker is most likely unavailable and the
+                # rest of the batch would fail the same way
+                backoff = min(2 ** attempts, MAX_BACKOFF)
+                with self.connect() as conn:
+                    conn.execute("UPDATE events SET attempts = attempts + 1, next_attempt = ? WHERE id = ?",
+                                 (time.time() + backoff, eventID))
+                with self.statsLock:
+                    self.counters["relay_failures"] += 1
+                print ("Outbox relay failed for event", eventID, "retrying in", backoff, "s:", e)
+                break
+            relayed.append(eventID)
+            with self.statsLock:
+                self.counters["relayed"] += 1
+                self.counters["last_relay_lag_seconds"] = time.time() - created
+        if relayed:
+            with self.connect() as conn:
+                conn.executemany("DELETE FROM events WHERE id = ?", [(eventID,) for eventID in relayed])
+        return len(relayed)
+
+    def stats(self):
+        with self.connect() as conn:
+            depth, oldest = conn.execute("SELECT COUNT(*), MIN(created) FROM events").fetchone()
+        with self.statsLock:
+            return dict(self.counters, depth=depth, oldest_pending_age_seconds=time.time() - oldest if oldest else 0.0)
@@ -3,37 +3,100 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS, cross_origin
 
 import json
-import pika
-import requests
 import os 
+import requests
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from httpclient import client
+from publisher import publisher
+from outbox import Outbox, OUTBOX_PATH
 
 app = Flask(__name__)
 CORS(app)
 
+# Monitoring and notification events are written to the outbox in the request path and
+# relayed to RabbitMQ in the background
+outbox = Outbox(OUTBOX_PATH, publisher)
+
+@app.route("/httpClientStats", methods=['GET'])
+def httpClientStats():
+    return jsonify(client.stats())
+
+@app.route("/publisherStats", methods=['GET'])
+def publisherStats():
+    return jsonify(publisher.stats())
+
+@app.route("/outboxStats", methods=['GET'])
+def outboxStats():
+    return jsonify(outbox.stats())
+
 @app.route("/orderRoute", methods=['POST'])
 @cross_origin(supports_credentials=True)
 def routeorder():
     OrderInfo = request.get_json()
     print (OrderInfo)
-    bookingcreationstatus = createOrder(OrderInfo) 
-    print (bookingcreationstatus)
-    if (bookingcreationstatus != False):       
+    if request.args.get("async", "false").lower() == "true":
+        return acceptOrder(OrderInfo)
+    bookingID = createOrder(OrderInfo) 
+    print (bookingID)
+    if (bookingID is not None):       
         pdtupdatestatus  = updateProduct(OrderInfo)
         sendMonitoring(OrderInfo)
         return jsonify(True)
     return jsonify(False)
 
 def createOrder(OrderInfo):
-    createStatus = requests.post("http://13.250.108.137:8000/booking/newbooking", json = json.dumps(OrderInfo))
+    return bookOrder(OrderInfo)[1]
+
+def bookOrder(OrderInfo):
+    # Returns (outcome, bookingID, error), classified like adjustProducts: "rejected" means
+    # Booking definitely did not create the booking; "unknown" means it may have
+    try:
+        createStatus = client.post("http://13.250.108.137:8000/booking/newbooking", json = json.dumps(OrderInfo))
+    except requests.exceptions.ConnectTimeout as e:
+        return "rejected", None, "Booking service unreachable: " + str(e)
+    except requests.exceptions.RequestException as e:
+        return "unknown", None, "Booking creation outcome unknown: " + str(e)
     if createStatus.status_code == 201:
-        return True
-    return False
+        try:
+            return "done", createStatus.json()["bookingID"], None
+        except (ValueError, KeyError) as e:
+            return "unknown", None, "Booking created but the response had no bookingID: " + str(e)
+    if 400 <= createStatus.status_code < 500:
+        return "rejected", None, "Booking creation rejected with status " + str(createStatus.status_code)
+    return "unknown", None, "Booking creation outcome unknown, status " + str(createStatus.status_code)
+
+def cancelOrder(bookingID):
+    cancelStatus = client.request("DELETE", "http://13.250.108.137:8000/booking/cancelbooking/" + str(bookingID))
+    return cancelStatus.status_code == 200
 
 def updateProduct(OrderInfo):
-    updateProduct = requests.put("http://13.250.108.137:8000/product/updateproductqty", json = json.dumps(OrderInfo))
+    return adjustProducts(OrderInfo)[0] == "done"
+
+def adjustProducts(OrderInfo):
+    # Returns (outcome, error). "rejected" means Product definitely did not change the
+    # stock; "unknown" means the decrement may or may not have been committed
+    try:
+        updateProduct = client.put("http://13.250.108.137:8000/product/updateproductqty", json = json.dumps(OrderInfo))
+    except requests.exceptions.ConnectTimeout as e:
+        # Never connected, so the request cannot have been applied
+        return "rejected", "Product service unreachable: " + str(e)
+    except requests.exceptions.RequestException as e:
+        return "unknown", "Product update outcome unknown: " + str(e)
     if updateProduct.status_code == 200:
-        return True
-    return False
+        return "done", None
+    if updateProduct.status_code == 409:
+        rejected = [r for r in updateProduct.json()['results'] if r['status'] != 'ok']
+        print ("Product update rejected:", rejected)
+        return "rejected", "Product quantities could not be updated"
+    if 400 <= updateProduct.status_code < 500:
+        return "rejected", "Product update rejected with status " + str(updateProduct.status_code)
+    return "unknown", "Product update outcome unknown, status " + str(updateProduct.status_code)
 
 
 def sendMonitoring(OrderInfo):
@@ -42,22 +105,204 @@ def sendMonitoring(OrderInfo):
     OrderInfo['Sender'] = 'OrderComposite'
     OrderInfo['Receipient'] = 'Monitoring'
     OrderInfo['Message'] = ">> Successfully created booking for " + OrderInfo['username'] + "\n>> Successfully updated product quantity for PIDS: (" + prods + ")"
-    #========= SENDING TO PRODUCT =========#
-    
-    hostname = "18.138.255.13"
-    port = 5672 
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=hostname, port=port))
-    channel = connection.channel()
-    exchangename="order_topic"
-    channel.exchange_declare(exchange=exchangename, exchange_type='topic')
-    channel.queue_declare(queue='monitoring')
-    channel.queue_bind(exchange=exchangename, queue='monitoring', routing_key='monitoring')
+    #========= SENDING TO MONITORING =========#
     replymessage = json.dumps(OrderInfo , default=str)
-    channel.basic_publish(exchange=exchangename,
-                          routing_key='monitoring',
-                          body=replymessage)
+    outbox.add('monitoring', replymessage)
     return "sent"
 
+#========= ASYNCHRONOUS ORDERS =========#
+# With /orderRoute?async=true the order is validated and accepted with a 202 straight
+# away, and a worker pool runs the booking -> product -> monitoring saga in the
+# background. Booking and Product calls are classified the same way: a connect timeout
+# or a 4xx is a definite rejection, while a read timeout, another transport error or a
+# 5xx after the request was sent leaves the outcome unknown. If Product definitely
+# rejects the stock update the booking is cancelled again. If a booking or stock outcome
+# is unknown, or the cancel itself fails, the order is marked needs_reconciliation for
+# someone to check the booking and stock. The frontend polls
+# /orderStatus/<orderID>, optionally with ?wait=<seconds> to block until the order
+# finishes. Every order and each step it starts is written to an orders table in the
+# outbox's SQLite file before the 202 goes out, so accepted orders survive a restart:
+# unfinished ones are resumed at startup, and a step that was in flight when the process
+# died is marked needs_reconciliation rather than repeated. Finished orders are kept for
+# ORDER_RETENTION seconds.
+ORDER_WORKERS = int(os.getenv('ORDER_WORKERS', '4'))
+ORDER_RETENTION = int(os.getenv('ORDER_RETENTION', '3600'))
+MAX_STATUS_WAIT = 30
+TERMINAL_STATES = ("completed", "failed", "needs_reconciliation")
+
+class OrderStore:
+    def __init__(self, path):
+        self.path = path
+        self.orders = {}
+        self.changed = threading.Condition()
+        with self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS orders ("
+                "order_id TEXT PRIMARY KEY, status TEXT NOT NULL, updated REAL NOT NULL, record TEXT NOT NULL)")
+            for (record,) in conn.execute("SELECT record FROM orders"):
+                order = json.loads(record)
+                self.orders[order["orderID"]] = order
+        with self.changed:
+            self.purge()
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save(self, order):
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO orders (order_id, status, updated, record) VALUES (?, ?, ?, ?)",
+                         (order["orderID"], order["status"], order["updated"], json.dumps(order, default=str)))
+
+    def add(self, OrderInfo):
+        orderID = uuid.uuid4().hex
+        with self.changed:
+            self.purge()
+            self.orders[orderID] = {"orderID": orderID, "status": "accepted", "bookingID": None,
+                                    "error": None, "steps": {}, "updated": time.time(), "order": OrderInfo}
+            self.save(self.orders[orderID])
+        return orderID
+
+    def update(self, orderID, **changes):
+        with self.changed:
+            order = self.orders[orderID]
+            steps = changes.pop("steps", {})
+            order["steps"].update(steps)
+            order.update(changes, updated=time.time())
+            self.save(order)
+            self.changed.notify_all()
+
+    def snapshot(self, orderID):
+        with self.changed:
+            order = self.orders[orderID]
+            return dict(order, steps=dict(order["steps"]))
+
+    def unfinished(self):
+        with self.changed:
+            return [orderID for orderID, order in self.orders.items() if order["status"] not in TERMINAL_STATES]
+
+    def get(self, orderID, wait=0):
+        deadline = time.monotonic() + wait
+        with self.changed:
+            while True:
+                order = self.orders.get(orderID)
+                remaining = deadline - time.monotonic()
+                if order is None or order["status"] in TERMINAL_STATES or remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            if order is None:
+                return None
+            return {key: value for key, value in order.items() if key != "order"}
+
+    def purge(self):
+        cutoff = time.time() - ORDER_RETENTION
+        expired = [oid for oid, order in self.orders.items()
+                   if order["status"] in TERMINAL_STATES and order["updated"] < cutoff]
+        for orderID in expired:
+            del self.orders[orderID]
+        if expired:
+            with self.connect() as conn:
+                conn.executemany("DELETE FROM orders WHERE order_id = ?", [(orderID,) for orderID in expired])
+
+orderStore = OrderStore(OUTBOX_PATH)
+orderWorkers = ThreadPoolExecutor(max_workers=ORDER_WORKERS, thread_name_prefix='order')
+
+def validateOrder(OrderInfo):
+    if not isinstance(OrderInfo, dict):
+        return "Order must be a JSON object"
+    if not isinstance(OrderInfo.get("username"), str) or not OrderInfo["username"]:
+        return "username is required"
+    products = OrderInfo.get("products")
+    if not isinstance(products, list) or not products:
+        return "products must be a non-empty list of product IDs"
+    for key in ("comments", "productProgress", "projStartDate", "projEndDate"):
+        if key not in OrderInfo:
+            return key + " is required"
+    return None
+
+def acceptOrder(OrderInfo):
+    error = validateOrder(OrderInfo)
+    if error is not None:
+        return jsonify({"status": "rejected", "error": error}), 400
+    orderID = orderStore.add(OrderInfo)
+    orderWorkers.submit(runOrderSaga, orderID)
+    response = jsonify({"orderID": orderID, "status": "accepted", "statusUrl": "/orderStatus/" + orderID})
+    response.headers["Location"] = "/orderStatus/" + orderID
+    return response, 202
+
+def needsReconciliation(orderID, step, error):
+    print ("Order", orderID, "needs reconciliation:", error)
+    orderStore.update(orderID, status="needs_reconciliation", error=error, steps={step: "unknown"})
+
+def runOrderSaga(orderID):
+    # Resumable: steps already done are skipped, and a step marked "started" was in
+    # flight when the process stopped, so its outcome is unknown
+    order = orderStore.snapshot(orderID)
+    OrderInfo, steps, bookingID = order["order"], order["steps"], order["bookingID"]
+    orderStore.update(orderID, status="processing")
+
+    if steps.get("booking") != "done":
+        if steps.get("booking") == "started":
+            needsReconciliation(orderID, "booking", "Interrupted while creating the booking")
+            return
+        orderStore.update(orderID, steps={"booking": "started"})
+        outcome, bookingID, error = bookOrder(OrderInfo)
+        if outcome == "unknown":
+            # The booking may exist without anything pointing at it
+            needsReconciliation(orderID, "booking", error)
+            return
+        if outcome == "rejected":
+            orderStore.update(orderID, status="failed", error=error, steps={"booking": "failed"})
+            return
+        orderStore.update(orderID, bookingID=bookingID, steps={"booking": "done"})
+
+    if steps.get("products") != "done":
+        if steps.get("products") == "started":
+            needsReconciliation(orderID, "products", "Interrupted while updating product quantities for booking " + str(bookingID))
+            return
+        orderStore.update(orderID, steps={"products": "started"})
+        outcome, error = adjustProducts(OrderInfo)
+        if outcome == "unknown":
+            # Cancelling now could leave stock decremented with no booking behind it
+            needsReconciliation(orderID, "products", error + " (booking " + str(bookingID) + ")")
+            return
+        if outcome == "rejected":
+            try:
+                cancelError = None if cancelOrder(bookingID) else "Cancelling booking " + str(bookingID) + " failed"
+            except Exception as e:
+                cancelError = "Cancelling booking " + str(bookingID) + " failed: " + str(e)
+            if cancelError is not None:
+                # The booking is still live with no stock behind it
+                print ("Order", orderID, "needs reconciliation:", cancelError)
+                orderStore.update(orderID, status="needs_reconciliation", error=error + "; " + cancelError,
+                                  steps={"products": "failed", "booking": "cancel failed"})
+                return
+            orderStore.update(orderID, status="failed", error=error, steps={"products": "failed", "booking": "cancelled"})
+            return
+        orderStore.update(orderID, steps={"products": "done"})
+
+    # The order itself is complete at this point; a lost monitoring event does not undo it
+    try:
+        sendMonitoring(OrderInfo)
+        orderStore.update(orderID, status="completed", steps={"monitoring": "done"})
+    except Exception as e:
+        print ("Monitoring event for order", orderID, "failed:", e)
+        orderStore.update(orderID, status="completed", steps={"monitoring": "failed"})
+
+@app.route("/orderStatus/<string:orderID>", methods=["GET"])
+@cross_origin(supports_credentials=True)
+def orderStatus(orderID):
+    wait = min(request.args.get("wait", 0, type=float), MAX_STATUS_WAIT)
+    order = orderStore.get(orderID, wait)
+    if order is None:
+        return jsonify({"error": "Unknown order"}), 404
+    return jsonify(order)
+
 @app.route("/sendnoti/<string:purpose>/<string:email>/<int:bookingID>", methods=["GET"])
 def sendNotification(purpose, email, bookingID):
     # print("YES")
@@ -69,37 +314,32 @@ def sendNotification(purpose, email, bookingID):
     elif (purpose == 'pass'):
         data = {"from": "B.Y Solutions <postmaster@sandbox2257105e012e438cab8c6547d9de3687.mailgun.org>",
 			  "to": [email],
-			  "subject": "Booking ID: " +  str(bookingID) + " Congratulations! Your booking has been successfully made.",
+			  "subject": "Booking ID: %recipient.bookingID% Congratulations! Your booking has been successfully made.",
 			  "text": "Dear Valued Customer, \n\nYour payment was successful and payment has been confirmed. \nOur product manager will contact you within the next 3 working days. \nThank you for your trust in B.Y Solutions \n\n\n\n\n\n\nYours Sincerely, \nB.Y Solutions"}
     elif (purpose == 'updated'):
         data = {"from": "B.Y Solutions <postmaster@sandbox2257105e012e438cab8c6547d9de3687.mailgun.org>",
 			  "to": [email],
-			  "subject": "Booking ID: " +  str(bookingID) + " Congratulations! Your booking has been updated.",
+			  "subject": "Booking ID: %recipient.bookingID% Congratulations! Your booking has been updated.",
 			  "text": "Dear Valued Customer, \n\nYour project has been updated with further details regarding it's progress. \nOur product manager has left information regarding in depth details of your project. \nThank you for your trust in B.Y Solutions \n\n\n\n\n\n\nYours Sincerely, \nB.Y Solutions"}
 
-    hostname = "18.138.255.13"
-    port = 5672
-    # broker on port 5672
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=hostname, port=port))
-    channel = connection.channel()
-    exchangename = "order_topic"
-    channel.exchange_declare(exchange=exchangename, exchange_type='topic')
+    # The booking ID is filled in per recipient, so identical notifications to different
+    # customers share a template and can be batched by the Notification service
+    data["recipient_variables"] = {"bookingID": bookingID}
     data = json.dumps(data, default=str)
-    
-    channel.queue_declare(queue='notification', durable=True)
-    channel.queue_bind(queue='notification', exchange=exchangename,
-                       routing_key='notification.send')
 
     #========= SENDING TO NOTIFICATIONS =========#
-    channel.basic_publish(exchange=exchangename, routing_key='notification.send', body=data,
-                           properties=pika.BasicProperties(delivery_mode=2, # persisent msg 
-                                                   )
-                          )
-    connection.close()
+    outbox.add('notification.send', data, persistent=True)
 
     return "YES"
 
 if __name__ == '__main__':
+    try:
+        publisher.start()
+    except Exception as e:
+        print ("RabbitMQ is unavailable, events will wait in the outbox:", e)
+    outbox.start()
+    for orderID in orderStore.unfinished():
+        print ("Resuming order", orderID)
+        orderWorkers.submit(runOrderSaga, orderID)
     app.run(host="0.0.0.0", port=5005, debug=False)
 
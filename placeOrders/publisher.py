@@ -0,0 +1,148 @@
+import os
+import queue
+import threading
+import time
+
+import pika
+
+# Long-lived RabbitMQ publisher for placeOrders. Publishing used to open a new
+# BlockingConnection, redeclare the topology and tear everything down for every message.
+# Now channels are pooled and reused, the topology is declared once, and every publish
+# waits for a broker confirm.
+#
+# pika's BlockingConnection is not thread-safe, so each pooled channel owns its own
+# connection and is checked out by one request thread at a time. Idle channels are
+# serviced by a keepalive thread so the broker does not drop them for missed heartbeats.
+
+RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', '18.138.255.13')
+RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', '5672'))
+EXCHANGE_NAME = 'order_topic'
+POOL_SIZE = int(os.getenv('PUBLISHER_POOL_SIZE', '4'))
+HEARTBEAT = int(os.getenv('PUBLISHER_HEARTBEAT', '60'))
+
+# (queue, queue_declare arguments, binding key) for the queues placeOrders owns. The
+# notification queue belongs to the Notification service, which declares it with its own
+# dead-letter and TTL arguments; redeclaring it here with different ones fails with
+# PRECONDITION_FAILED. Publishes are mandatory instead, so an event that no queue is bound
+# for yet is returned, raises UnroutableError and stays in the outbox to be retried.
+TOPOLOGY = [
+    ('monitoring', {}, 'monitoring'),
+]
+
+RECONNECT_ERRORS = (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError)
+
+
+class RabbitPublisher:
+    def __init__(self):
+        self.pool = queue.LifoQueue()
+        for _ in range(POOL_SIZE):
+            self.pool.put(None)
+        self.declared = False
+        self.declareLock = threading.Lock()
+        self.statsLock = threading.Lock()
+        self.keepaliveThread = None
+        self.counters = {"published": 0, "failed": 0, "connections_opened": 0, "reconnects": 0}
+        self.latency = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "last_seconds": 0.0}
+
+    def start(self):
+        # Opens the first channel and declares the topology before any request arrives
+        if self.keepaliveThread is None:
+            self.keepaliveThread = threading.Thread(target=self.keepalive, name='publisher-keepalive', daemon=True)
+            self.keepaliveThread.start()
+        slot = self.pool.get()
+        try:
+            if slot is None:
+                slot = self.connect()
+        finally:
+            self.pool.put(slot)
+
+    def connect(self):
+        connection = pika.BlockingConnection(pika.ConnectionParameters(
+            host=RABBITMQ_HOST, port=RABBITMQ_PORT, heartbeat=HEARTBEAT, blocked_connection_timeout=30))
+        channel = connection.channel()
+        channel.confirm_delivery()
+        with self.declareLock:
+            if not self.declared:
+                channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic')
+                for queueName, arguments, routingKey in TOPOLOGY:
+                    channel.queue_declare(queue=queueName, **arguments)
+                    channel.queue_bind(exchange=EXCHANGE_NAME, queue=queueName, routing_key=routingKey)
+                self.declared = True
+        with self.statsLock:
+            self.counters["connections_opened"] += 1
+        return (connection, channel)
+
+    @staticmethod
+    def close(slot):
+        if slot is not None and slot[0].is_open:
+            try:
+                slot[0].close()
+            except Exception:
+                pass
+
+    def publish(self, routingKey, body, properties=None):
+        start = time.perf_counter()
+        slot = self.pool.get()
+        try:
+            for attempt in (1, 2):
+                try:
+                    if slot is None or slot[0].is_closed:
+                        slot = self.connect()
+                    slot[1].basic_publish(exchange=EXCHANGE_NAME, routing_key=routingKey, body=body,
+                                          properties=properties, mandatory=True)
+                    break
+                except pika.exceptions.UnroutableError:
+                    # The channel is fine, there is just no queue for this routing key yet
+                    raise
+                except RECONNECT_ERRORS:
+                    # The broker or network dropped this channel. Reconnect, redeclare in
+                    # case the broker restarted and lost the non-durable exchange, retry once.
+                    self.close(slot)
+                    slot = None
+                    self.declared = False
+                    with self.statsLock:
+                        self.counters["reconnects"] += 1
+                    if attempt == 2:
+                        raise
+        except Exception:
+            with self.statsLock:
+                self.counters["failed"] += 1
+            raise
+        finally:
+            self.pool.put(slot)
+
+        elapsed = time.perf_counter() - start
+        with self.statsLock:
+            self.counters["published"] += 1
+            self.latency["count"] += 1
+            self.latency["total_seconds"] += elapsed
+            self.latency["max_seconds"] = max(self.latency["max_seconds"], elapsed)
+            self.latency["last_seconds"] = elapsed
+
+    def keepalive(self):
+        while True:
+            time.sleep(max(HEARTBEAT / 2, 1))
+            # Only touch channels that are idle; a checked-out channel is busy publishing
+            idle = []
+            while True:
+                try:
+                    idle.append(self.pool.get_nowait())
+                except queue.Empty:
+                    break
+            for slot in idle:
+                try:
+                    if slot is not None and slot[0].is_open:
+                        slot[0].process_data_events(time_limit=0)
+                except Exception:
+                    self.close(slot)
+                    slot = None
+                self.pool.put(slot)
+
+    def stats(self):
+        with self.statsLock:
+            latency = dict(self.latency)
+            latency["avg_seconds"] = latency["total_seconds"] / latency["count"] if latency["count"] else 0.0
+            return dict(self.counters, pool_size=POOL_SIZE, idle_channels=self.pool.qsize(), publish_latency=latency)
+
+
+publisher = RabbitPublisher()
@@ -0,0 +1,34 @@
+import pika
+
+from outbox import Outbox, eventProperties
+
+
+class RecordingPublisher:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, routingKey, body, properties=None):
+        # Encoding is what a real channel does before the frame goes out
+        properties.encode()
+        self.published.append((routingKey, body, properties))
+
+
+def test_event_properties_encode():
+    created = 1700000000.123456
+    properties = eventProperties(True, created, 'abc123')
+    decoded = pika.BasicProperties()
+    decoded.decode(b''.join(properties.encode()))
+    assert decoded.message_id == 'abc123'
+    assert decoded.delivery_mode == 2
+    assert decoded.headers['x-published-at'] == 1700000000123
+
+
+def test_relay_publishes_encodable_properties(tmp_path):
+    publisher = RecordingPublisher()
+    outbox = Outbox(str(tmp_path / 'outbox.sqlite3'), publisher)
+    outbox.add('order.booked', '{"orderID": 1}', persistent=True)
+    outbox.add('order.notify', '{"orderID": 1}')
+
+    assert outbox.relayBatch() == 2
+    assert [routingKey for routingKey, _, _ in publisher.published] == ['order.booked', 'order.notify']
+    assert outbox.stats()["depth"] == 0